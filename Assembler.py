@@ -0,0 +1,184 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import array
+import sys
+import typing
+
+PREDEFINED = {
+    "SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4,
+    "SCREEN": 16384, "KBD": 24576,
+}
+PREDEFINED.update({f"R{i}": i for i in range(16)})
+
+# comp mnemonic -> the bits above dest and jump: the 3 bit prefix (101 for
+# the shift extension, 111 otherwise), the "a" bit and the 6 control bits
+COMP = {
+    "0": "1110101010", "1": "1110111111", "-1": "1110111010",
+    "D": "1110001100", "A": "1110110000", "M": "1111110000",
+    "!D": "1110001101", "!A": "1110110001", "!M": "1111110001",
+    "-D": "1110001111", "-A": "1110110011", "-M": "1111110011",
+    "D+1": "1110011111", "A+1": "1110110111", "M+1": "1111110111",
+    "D-1": "1110001110", "A-1": "1110110010", "M-1": "1111110010",
+    "D+A": "1110000010", "D+M": "1111000010",
+    "D-A": "1110010011", "D-M": "1111010011",
+    "A-D": "1110000111", "M-D": "1111000111",
+    "D&A": "1110000000", "D&M": "1111000000",
+    "D|A": "1110010101", "D|M": "1111010101",
+    "A<<": "1010100000", "D<<": "1010110000", "M<<": "1011100000",
+    "A>>": "1010000000", "D>>": "1010010000", "M>>": "1011000000",
+}
+# the commutative operations may be written both ways
+for _comp in ("D+A", "D+M", "D&A", "D&M", "D|A", "D|M"):
+    COMP[_comp[2] + _comp[1] + _comp[0]] = COMP[_comp]
+JUMP = {"": 0, "JGT": 1, "JEQ": 2, "JGE": 3,
+        "JLT": 4, "JNE": 5, "JLE": 6, "JMP": 7}
+# the first RAM address of variables
+VARIABLES_BASE = 16
+
+
+class Assembler:
+    """Translates Hack assembly code into 16-bit machine words.
+
+    Works in two passes: the first one assigns ROM addresses to labels, the
+    second one translates the instructions, allocating a RAM address from
+    16 upward to every other symbol (like "frame" or "Xxx.i") the first time
+    it is used.
+    """
+
+    def __init__(self) -> None:
+        self.symbols = dict(PREDEFINED)
+        self.next_variable = VARIABLES_BASE
+        # the instructions of the first pass, waiting for the second one
+        self.instructions = []
+
+    def assemble(self, lines: typing.Iterable[str]) -> typing.List[int]:
+        """Assembles a program.
+
+        Args:
+            lines (typing.Iterable[str]): the assembly code, one instruction
+                or label per line. Comments and whitespace are ignored.
+
+        Returns:
+            typing.List[int]: the machine words.
+        """
+        self.add_lines(lines)
+        return self.words()
+
+    def add_lines(self, lines: typing.Iterable[str]) -> None:
+        """The first pass, over the next lines of the program: assigns ROM
+        addresses to their labels and keeps their instructions.
+
+        Args:
+            lines (typing.Iterable[str]): the assembly code, one instruction
+                or label per line. Comments and whitespace are ignored.
+        """
+        instructions = self.instructions
+        for line in lines:
+            line = line.split("//", 1)[0].strip()
+            if not line:
+                continue
+            if line[0] == "(":
+                label = line[1:-1]
+                if label in self.symbols and label not in PREDEFINED:
+                    raise ValueError(f"Label defined twice: {label}")
+                self.symbols[label] = len(instructions)
+            else:
+                instructions.append(line)
+
+    def words(self) -> typing.List[int]:
+        """The second pass, once all the labels are known.
+
+        Returns:
+            typing.List[int]: the machine words of all the lines added.
+        """
+        return [self.translate(instruction) for instruction in self.instructions]
+
+    def translate(self, instruction: str) -> int:
+        """Translates a single instruction, after all labels are known.
+
+        Args:
+            instruction (str): an A- or C-instruction.
+
+        Returns:
+            int: the machine word.
+        """
+        if instruction[0] == "@":
+            symbol = instruction[1:]
+            if symbol.isdigit():
+                value = int(symbol)
+            else:
+                value = self.symbols.get(symbol)
+                if value is None:
+                    value = self.symbols[symbol] = self.next_variable
+                    self.next_variable += 1
+            if value > 0x7FFF:
+                raise ValueError(f"Address out of range: {instruction}")
+            return value
+
+        dest, _, rest = instruction.rpartition("=")
+        comp, _, jump = rest.partition(";")
+        if comp not in COMP or jump not in JUMP:
+            raise ValueError(f"Invalid instruction: {instruction}")
+        dest_bits = ("A" in dest) << 2 | ("D" in dest) << 1 | ("M" in dest)
+        return int(COMP[comp], 2) << 6 | dest_bits << 3 | JUMP[jump]
+
+
+def assemble(text: str) -> typing.Tuple[typing.List[int], typing.Dict[str, int]]:
+    """Assembles a whole program.
+
+    Args:
+        text (str): the assembly code.
+
+    Returns:
+        typing.Tuple[typing.List[int], typing.Dict[str, int]]: the machine
+        words and the symbol table.
+    """
+    assembler = Assembler()
+    return assembler.assemble(text.splitlines()), assembler.symbols
+
+
+class HackStream:
+    """An output stream that assembles the code written to it instead of
+    writing it out as text, so the translator can emit machine code without
+    an .asm file in between.
+
+    The first pass runs as the code comes in; the words are only written in
+    finish(), once all the labels are known.
+    """
+
+    def __init__(self, output_file: typing.IO, binary: bool = False) -> None:
+        """Initializes the stream.
+
+        Args:
+            output_file (typing.IO): where to write the machine code: a text
+                file, or a binary one if binary is True.
+            binary (bool): write the words packed, 2 bytes each, big-endian,
+                instead of one line of 16 "0"/"1" characters per word.
+        """
+        self.file = output_file
+        self.binary = binary
+        self.assembler = Assembler()
+
+    def write(self, text: str) -> None:
+        self.assembler.add_lines(text.splitlines())
+
+    def flush(self) -> None:
+        # nothing can be written before the last label is known
+        pass
+
+    def finish(self) -> None:
+        """Translates everything written so far and writes it out."""
+        words = self.assembler.words()
+        if self.binary:
+            packed = array.array("H", words)
+            if sys.byteorder == "little":
+                packed.byteswap()
+            self.file.write(packed.tobytes())
+        else:
+            self.file.write("".join(f"{word:016b}\n" for word in words))
+        self.file.flush()
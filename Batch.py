@@ -0,0 +1,123 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import shlex
+import sys
+import time
+import typing
+import Main
+from Main import Translation
+
+
+def read_manifest(manifest_path: str, common: typing.List[str]
+                  ) -> typing.List[argparse.Namespace]:
+    """Reads the programs to translate.
+
+    Args:
+        manifest_path (str): a file with a program on every line: its path
+            (relative to the manifest), then options of VMtranslator for it
+            alone. Blank lines and lines starting with # are skipped.
+        common (typing.List[str]): options of VMtranslator for every
+            program, before the options of its line.
+
+    Returns:
+        typing.List[argparse.Namespace]: the options of every program.
+
+    Raises:
+        ValueError: for a line with bad options.
+    """
+    directory = os.path.dirname(os.path.abspath(manifest_path))
+    arg_parser = Main.build_arg_parser()
+    programs = []
+    with open(manifest_path, "r") as manifest:
+        for number, line in enumerate(manifest, 1):
+            words = shlex.split(line, comments=True)
+            if not words:
+                continue
+            path = os.path.join(directory, words[0])
+            try:
+                programs.append(
+                    arg_parser.parse_args(common + words[1:] + ["--", path]))
+            except SystemExit:
+                # argparse already printed why
+                raise ValueError(f"{manifest_path}:{number}: bad options")
+    return programs
+
+
+def translate_program(args: argparse.Namespace) -> Translation:
+    """Translates a single program of the batch, in a worker process when
+    translating with --workers. A failure only fails its own program.
+
+    Args:
+        args (argparse.Namespace): the options of the program.
+
+    Returns:
+        Translation: the result.
+    """
+    started = time.perf_counter()
+    try:
+        if not os.path.exists(args.path):
+            raise FileNotFoundError(f"no such file or directory: {args.path}")
+        return Main.translate_program(args)
+    except Exception as error:
+        result = Translation(args.path, None)
+        result.status = 1
+        result.error = f"{type(error).__name__}: {error}"
+        result.seconds = time.perf_counter() - started
+        return result
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser(
+        prog="VMtranslator-batch",
+        description="Translates many programs in a single process. Other "
+                    "options are passed to VMtranslator for every program.")
+    arg_parser.add_argument(
+        "manifest", help="a file with a program (and its own options) on "
+                         "every line")
+    arg_parser.add_argument(
+        "--workers", type=int, default=1, metavar="N",
+        help="translate N programs at a time, in worker processes")
+    arg_parser.add_argument(
+        "--json", metavar="FILE",
+        help="write the results (status, timing, size, statistics and "
+             "report) of every program to FILE")
+    args, common = arg_parser.parse_known_args()
+    started = time.perf_counter()
+    try:
+        programs = read_manifest(args.manifest, common)
+    except (OSError, ValueError) as error:
+        print(f"error: {error}", file=sys.stderr)
+        sys.exit(2)
+
+    if args.workers > 1 and len(programs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(args.workers) as pool:
+            results = list(pool.map(translate_program, programs))
+    else:
+        results = [translate_program(program) for program in programs]
+
+    for result in results:
+        for line in result.messages:
+            print(f"{result.path}: {line}", file=sys.stderr)
+        if result.error is not None:
+            print(f"{result.path}: error: {result.error}", file=sys.stderr)
+        print(f"{'ok' if result.status == 0 else 'FAILED':6s} "
+              f"{result.seconds:8.3f}s {result.instructions:8d} words  "
+              f"{result.path}")
+    failed = sum(result.status != 0 for result in results)
+    print(f"batch: {len(results)} programs, {failed} failed, translated in "
+          f"{sum(result.seconds for result in results):.3f}s, "
+          f"{time.perf_counter() - started:.3f}s in total", file=sys.stderr)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump([vars(result) for result in results], json_file,
+                      indent=2)
+    sys.exit(1 if failed else 0)
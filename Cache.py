@@ -0,0 +1,206 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import collections
+import glob
+import hashlib
+import json
+import os
+import typing
+
+
+def translator_version() -> str:
+    """
+    Returns:
+        str: a hash of the translator's own source files, so that changing
+        the translator invalidates everything it cached before.
+    """
+    if translator_version.version is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for path in sorted(glob.glob(os.path.join(directory, "*.py"))):
+            with open(path, "rb") as source:
+                digest.update(source.read())
+        translator_version.version = digest.hexdigest()
+    return translator_version.version
+
+
+translator_version.version = None
+
+
+class TranslationCache:
+    """An on-disk cache of translated files.
+
+    Every entry holds the assembly fragment of a single .vm file together
+    with the statistics of its translation. Entries are keyed by a hash of
+    the file's name and content, the translator version and the options.
+    When the cache grows beyond its size limit, the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        """Opens (and creates, if needed) the cache directory.
+
+        Args:
+            directory (str): where to keep the entries.
+            max_bytes (int): the size limit of all the entries together.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, input_path: str, options: dict,
+            commands: typing.Optional[list] = None) -> str:
+        """Computes the key of a file.
+
+        Args:
+            input_path (str): the .vm file.
+            options (dict): the translation options.
+            commands (list): the commands to translate, when they are not
+                simply the ones in the file (after whole program passes).
+
+        Returns:
+            str: the key of the file's entry.
+        """
+        digest = hashlib.sha256()
+        digest.update(translator_version().encode())
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        # the file name matters too, it is part of static variables and labels
+        digest.update(os.path.basename(input_path).encode() + b"\0")
+        if commands is not None:
+            digest.update("\n".join(map(repr, commands)).encode())
+        else:
+            with open(input_path, "rb") as input_file:
+                digest.update(input_file.read())
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key: str) -> typing.Optional[typing.Tuple[str, dict]]:
+        """Looks up an entry, and marks it as recently used.
+
+        Args:
+            key (str): the key of the entry.
+
+        Returns:
+            typing.Optional[typing.Tuple[str, dict]]: the assembly fragment
+            and statistics, or None if the entry is missing.
+        """
+        try:
+            with open(self.path(key), "r") as entry_file:
+                entry = json.load(entry_file)
+            os.utime(self.path(key))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["text"], entry["stats"]
+
+    def put(self, key: str, text: str, stats: dict) -> None:
+        """Stores an entry. Call evict() once done storing entries.
+
+        Args:
+            key (str): the key of the entry.
+            text (str): the assembly fragment.
+            stats (dict): the statistics of the translation.
+        """
+        # Written under a temporary name, so readers never see half an entry
+        temporary_path = f"{self.path(key)}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as entry_file:
+            json.dump({"text": text, "stats": stats}, entry_file)
+        os.replace(temporary_path, self.path(key))
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the cache fits in
+        its size limit.
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            entries.append((status.st_mtime, status.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evicted += 1
+
+    def summary(self) -> str:
+        return f"cache: {self.hits} hits, {self.misses} misses, " \
+               f"{self.evicted} evicted"
+
+
+class MemoryCache:
+    """A cache of translated files in memory, for a translator that keeps
+    running between builds (see Daemon.py). It has the interface of
+    TranslationCache.
+
+    Files are recognized by their path, modification time and size instead
+    of a hash of their content, so looking one up does not even read it.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        """Initializes the cache.
+
+        Args:
+            max_bytes (int): the size limit of all the fragments together.
+        """
+        self.max_bytes = max_bytes
+        # key -> (assembly fragment, statistics), least recently used first
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def key(self, input_path: str, options: dict,
+            commands: typing.Optional[list] = None) -> str:
+        """Computes the key of a file, see TranslationCache.key."""
+        if commands is not None:
+            content = hashlib.sha256(
+                "\n".join(map(repr, commands)).encode()).hexdigest()
+        else:
+            status = os.stat(input_path)
+            content = f"{status.st_mtime_ns}:{status.st_size}"
+        return f"{os.path.abspath(input_path)}\0" \
+               f"{json.dumps(options, sort_keys=True)}\0{content}"
+
+    def get(self, key: str) -> typing.Optional[typing.Tuple[str, dict]]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, text: str, stats: dict) -> None:
+        if key in self.entries:
+            self.size -= len(self.entries[key][0])
+        self.entries[key] = (text, stats)
+        self.size += len(text)
+
+    def evict(self) -> None:
+        while self.size > self.max_bytes and self.entries:
+            _, (text, _) = self.entries.popitem(last=False)
+            self.size -= len(text)
+            self.evicted += 1
+
+    def summary(self) -> str:
+        return f"cache: {self.hits} hits, {self.misses} misses, " \
+               f"{self.evicted} evicted"
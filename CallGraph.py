@@ -0,0 +1,79 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import Command
+
+
+class CallGraph:
+    """The functions of a whole program and the calls between them, built
+    from the "function" and "call" commands of all its files.
+    """
+
+    def __init__(self) -> None:
+        # function name -> the names of the functions it calls
+        self.calls = {}
+        # function name -> the number of commands in its body
+        self.sizes = {}
+
+    def add(self, commands: typing.Iterable[Command]) -> None:
+        """Adds the functions of a single file.
+
+        Args:
+            commands (typing.Iterable[Command]): the commands of the file.
+        """
+        function = None
+        for command in commands:
+            if command.type == "C_FUNCTION":
+                function = command.arg1
+                self.calls.setdefault(function, set())
+                self.sizes[function] = 0
+            elif function is not None:
+                self.sizes[function] += 1
+                if command.type == "C_CALL":
+                    self.calls[function].add(command.arg1)
+
+    def reachable(self, roots: typing.Iterable[str]) -> typing.Set[str]:
+        """Finds every function that can be called, directly or not, from
+        the given functions.
+
+        Args:
+            roots (typing.Iterable[str]): where the program starts.
+
+        Returns:
+            typing.Set[str]: the reachable functions, including the roots.
+        """
+        reached = set()
+        pending = [root for root in roots if root in self.calls]
+        while pending:
+            function = pending.pop()
+            if function in reached:
+                continue
+            reached.add(function)
+            pending.extend(callee for callee in self.calls[function]
+                           if callee in self.calls and callee not in reached)
+        return reached
+
+
+def prune(commands: typing.Iterable[Command],
+          functions: typing.Set[str]) -> typing.Iterator[Command]:
+    """Drops the functions that are not in the given set. Commands outside
+    of any function are kept.
+
+    Args:
+        commands (typing.Iterable[Command]): the commands of a file.
+        functions (typing.Set[str]): the functions to keep.
+
+    Returns:
+        typing.Iterator[Command]: the commands of the kept functions.
+    """
+    keep = True
+    for command in commands:
+        if command.type == "C_FUNCTION":
+            keep = command.arg1 in functions
+        if keep:
+            yield command
@@ -0,0 +1,54 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import json
+import os
+import socket
+import sys
+import tempfile
+import typing
+
+# Where the daemon listens, unless VMTRANSLATOR_SOCKET says otherwise
+DEFAULT_SOCKET = os.environ.get("VMTRANSLATOR_SOCKET") or os.path.join(
+    tempfile.gettempdir(), f"vmtranslator-{os.getuid()}.sock")
+
+
+def request(argv: typing.List[str], socket_path: str = DEFAULT_SOCKET) -> dict:
+    """Asks the daemon to translate, as if running "VMtranslator argv".
+
+    Args:
+        argv (typing.List[str]): the command line options of Main.py.
+        socket_path (str): the socket of the daemon.
+
+    Returns:
+        dict: the exit status under "status", and what the translation
+        printed under "stdout" and "stderr".
+
+    Raises:
+        OSError: if there is no daemon listening.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(json.dumps(
+            {"cwd": os.getcwd(), "argv": argv}).encode() + b"\n")
+        response = connection.makefile("rb").readline()
+    if not response:
+        raise ConnectionError("the daemon closed the connection")
+    return json.loads(response)
+
+
+if "__main__" == __name__:
+    # A drop-in replacement for "VMtranslator <path> [options]", that
+    # translates in the daemon when it runs, and here otherwise
+    try:
+        response = request(sys.argv[1:])
+    except OSError:
+        import Main
+        sys.exit(Main.main(sys.argv[1:]))
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    sys.exit(response["status"])
@@ -5,8 +5,11 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import collections
+import functools
 import os
 import typing
+from SourceMap import MARK, ENTRY_MARK
 
 binary = {
     "add": "M=M+D",
@@ -25,21 +28,560 @@ comparisons = {"eq": "JEQ", "gt": "JGT", "lt": "JLT", "ge": "JGE"}
 
 PUSH = ["@SP", "A=M", "M=D", "@SP", "M=M+1"]
 
+# The fixed code blocks, joined into text once instead of on every write
+PUSH_CODE = "\n".join(PUSH)
+POP_CODE = "\n".join([
+    "D=A",  # D = computed address
+    "@R13",  # use R13 as a temporary register
+    "M=D",  # R13 = target address
+
+    # 2. Pop the top value from the stack into D
+    "@SP",
+    "M=M-1",  # SP--
+    "A=M",  # A = new top of stack
+    "D=M",  # D = *SP (popped value)
+
+    # 3. Write D to the target address stored in R13
+    "@R13",
+    "A=M",  # A = target address
+    "M=D"  # *addr = D
+])
+BINARY_CODE = {command: "\n".join([
+    f"// binary operation: {command}",
+    # pop y into D
+    "@SP",
+    "M=M-1",
+    "A=M",
+    "D=M",
+    # pop x and apply operation with D
+    "@SP",
+    "M=M-1",
+    "A=M",
+    operation,  # M=M+D, M=M-D, M=M&D, M=M|D
+    # push result (increment SP)
+    "@SP",
+    "M=M+1"]) + "\n" for command, operation in binary.items()}
+UNARY_CODE = {command: "\n".join([
+    f"// unary operation: {command}",
+    # access top of stack (SP-1)
+    "@SP",
+    "A=M-1",
+    # apply the operator in-place
+    operation]) + "\n" for command, operation in unary.items()}  # M=-M or M=!M
+IF_POP_CODE = "\n".join(["@SP", "M=M-1", "A=M", "D=M"])
+
+
+def comparison_code(command: str, prefix: str) -> typing.List[str]:
+    """Builds the code of a comparison, that pushes -1 (true) or 0 (false).
+
+    Args:
+        command (str): "eq", "gt" or "lt".
+        prefix (str): the prefix of the labels of this comparison.
+
+    Returns:
+        typing.List[str]: the assembly code of the comparison.
+    """
+    true_label = f"{prefix}TRUE"
+    end_label = f"{prefix}END"
+    if command == "eq":
+        # Handle equality comparison: true if x == y, false otherwise
+        return [
+            "// comparison: eq",
+            # Pop y into D
+            "@SP", "M=M-1", "A=M", "D=M",
+            # Pop x and compute x - y
+            "@SP", "M=M-1", "A=M", "D=M-D",
+            # If result is zero -> x == y
+            f"@{true_label}", "D;JEQ",
+            # False case: write 0
+            "@SP", "A=M", "M=0",
+            f"@{end_label}", "0;JMP",
+            # True case: write -1
+            f"({true_label})",
+            "@SP", "A=M", "M=-1",
+            # Finish: increment SP
+            f"({end_label})",
+            "@SP", "M=M+1"
+        ]
+
+    # Handle signed greater-than / less-than in a way that avoids overflow
+    x_neg = f"{prefix}X_NEG"
+    same_sign = f"{prefix}SAME_SIGN"
+    x_pos_y_neg = f"{prefix}X_POS_Y_NEG"
+    x_neg_y_non_neg = f"{prefix}X_NEG_Y_NON_NEG"
+
+    code = [
+        f"// comparison: {command}",
+        # Pop y into R13
+        "@SP", "M=M-1", "A=M", "D=M",
+        "@R13", "M=D",
+        # Pop x into R14
+        "@SP", "M=M-1", "A=M", "D=M",
+        "@R14", "M=D",
+
+        # Check sign of x
+        "@R14", "D=M",
+        f"@{x_neg}", "D;JLT",  # If x < 0 -> go to X_NEG
+
+        # Here x >= 0, now check sign of y
+        "@R13", "D=M",
+        f"@{x_pos_y_neg}", "D;JLT",  # If y < 0 -> x>=0,y<0
+        f"@{same_sign}", "0;JMP",  # Otherwise: same sign
+
+        # X_NEG: x < 0, now check sign of y
+        f"({x_neg})",
+        "@R13", "D=M",
+        f"@{x_neg_y_non_neg}", "D;JGE",  # If y >= 0 -> x<0,y>=0
+        f"@{same_sign}", "0;JMP",  # Otherwise: both negative -> same sign
+
+        # Case: x>=0, y<0 (different signs)
+        f"({x_pos_y_neg})",
+    ]
+
+    if command == "gt":
+        # For gt: x>=0,y<0 => always true
+        code += ["@SP", "A=M", "M=-1", f"@{end_label}", "0;JMP"]
+    else:
+        # For lt: x>=0,y<0 => always false
+        code += ["@SP", "A=M", "M=0", f"@{end_label}", "0;JMP"]
+
+    # Case: x<0, y>=0 (different signs)
+    code += [
+        f"({x_neg_y_non_neg})",
+    ]
+
+    if command == "gt":
+        # For gt: x<0,y>=0 => always false
+        code += ["@SP", "A=M", "M=0", f"@{end_label}", "0;JMP"]
+    else:
+        # For lt: x<0,y>=0 => always true
+        code += ["@SP", "A=M", "M=-1", f"@{end_label}", "0;JMP"]
+
+    # Same-sign case: now it is safe to use x - y
+    code += [
+        f"({same_sign})",
+        "@R14", "D=M",  # D = x
+        "@R13", "D=D-M",  # D = x - y
+        f"@{true_label}", "D;JGT" if command == "gt" else "D;JLT",
+        # False case
+        "@SP", "A=M", "M=0",
+        f"@{end_label}", "0;JMP",
+        # True case
+        f"({true_label})",
+        "@SP", "A=M", "M=-1",
+        # Finish: increment SP
+        f"({end_label})",
+        "@SP", "M=M+1"
+    ]
+    return code
+
+
+# Comparisons with a single "{0}" slot for the prefix of their labels
+COMPARISON_TEMPLATES = {command: "\n".join(comparison_code(command, "{0}"))
+                        for command in ("eq", "gt", "lt")}
+
+
+def cached_comparison_code(command: str, prefix: str) -> typing.List[str]:
+    """Builds the code of a comparison for the top-of-stack cache: y is
+    already in D, x is on the stack, and the result is left in D.
+
+    Args:
+        command (str): "eq", "gt" or "lt".
+        prefix (str): the prefix of the labels of this comparison.
+
+    Returns:
+        typing.List[str]: the assembly code of the comparison.
+    """
+    true_label = f"{prefix}TRUE"
+    end_label = f"{prefix}END"
+    if command == "eq":
+        return [
+            "// comparison: eq",
+            # D = x - y
+            "@SP", "AM=M-1", "D=M-D",
+            f"@{true_label}", "D;JEQ",
+            "D=0", f"@{end_label}", "0;JMP",
+            f"({true_label})", "D=-1",
+            f"({end_label})"
+        ]
+
+    # x - y may overflow when the signs differ, so those cases are decided
+    # by the signs alone, like in comparison_code
+    x_neg = f"{prefix}X_NEG"
+    same_sign = f"{prefix}SAME_SIGN"
+    x_pos_y_neg = f"{prefix}X_POS_Y_NEG"
+    x_neg_y_non_neg = f"{prefix}X_NEG_Y_NON_NEG"
+    return [
+        f"// comparison: {command}",
+        # R13 = y, D = R14 = x
+        "@R13", "M=D",
+        "@SP", "AM=M-1", "D=M",
+        "@R14", "M=D",
+        f"@{x_neg}", "D;JLT",
+        "@R13", "D=M",
+        f"@{x_pos_y_neg}", "D;JLT",
+        f"@{same_sign}", "0;JMP",
+        f"({x_neg})",
+        "@R13", "D=M",
+        f"@{x_neg_y_non_neg}", "D;JGE",
+        # both negative: fall through to the same sign case
+        f"({same_sign})",
+        "@R14", "D=M",
+        "@R13", "D=D-M",
+        f"@{true_label}", "D;JGT" if command == "gt" else "D;JLT",
+        "D=0", f"@{end_label}", "0;JMP",
+        f"({x_pos_y_neg})",
+        "D=-1" if command == "gt" else "D=0", f"@{end_label}", "0;JMP",
+        f"({x_neg_y_non_neg})",
+        "D=0" if command == "gt" else "D=-1", f"@{end_label}", "0;JMP",
+        f"({true_label})", "D=-1",
+        f"({end_label})"
+    ]
+
+
+# The top-of-stack cache: the same commands, for when the top of the stack
+# is held in D instead of RAM[SP-1]
+# D = pop()
+POP_D_CODE = "\n".join(["@SP", "AM=M-1", "D=M"]) + "\n"
+# push(D), when the next value is about to be loaded into D
+SPILL_CODE = "\n".join(["@SP", "AM=M+1", "A=A-1", "M=D"]) + "\n"
+CACHED_BINARY_CODE = {command: "\n".join([
+    f"// binary operation: {command}",
+    # pop x and apply the operation with y, which is in D
+    "@SP", "AM=M-1", operation]) + "\n"
+    for command, operation in {
+        "add": "D=D+M", "sub": "D=M-D", "and": "D=D&M", "or": "D=D|M"}.items()}
+CACHED_UNARY_CODE = {command: "\n".join([
+    f"// unary operation: {command}", operation]) + "\n"
+    for command, operation in {
+        "not": "D=!D", "neg": "D=-D",
+        "shiftleft": "D=D<<", "shiftright": "D=D>>"}.items()}
+CACHED_COMPARISON_TEMPLATES = {
+    command: "\n".join(cached_comparison_code(command, "{0}"))
+    for command in ("eq", "gt", "lt")}
+# Pops to base segment indexes up to this one walk there with A=A+1, instead
+# of computing the address through R13 and R14
+MAX_POP_STEPS = 7
+
+
+def compare_branch_code(command: str, negated: bool, target: str,
+                        prefix: str) -> typing.List[str]:
+    """Builds a comparison that jumps to a label instead of pushing its
+    result, for "eq/gt/lt [not] if-goto". y is already in D, x is on the
+    stack, and both are popped.
+
+    Args:
+        command (str): "eq", "gt" or "lt".
+        negated (bool): jump if the comparison is false instead.
+        target (str): the label to jump to.
+        prefix (str): the prefix of the labels of this comparison.
+
+    Returns:
+        typing.List[str]: the assembly code.
+    """
+    if command == "eq":
+        return [f"// branch: {'not ' if negated else ''}eq",
+                "@SP", "AM=M-1", "D=M-D",
+                f"@{target}", "D;JNE" if negated else "D;JEQ"]
+
+    # x - y only decides when the signs are the same, as in comparison_code
+    x_neg = f"{prefix}X_NEG"
+    same_sign = f"{prefix}SAME_SIGN"
+    end = f"{prefix}END"
+    # where to go when the signs alone decide x > y or x < y
+    if_greater = end if (command == "gt") == negated else target
+    if_less = target if if_greater == end else end
+    jump = {("gt", False): "D;JGT", ("gt", True): "D;JLE",
+            ("lt", False): "D;JLT", ("lt", True): "D;JGE"}[command, negated]
+    return [
+        f"// branch: {'not ' if negated else ''}{command}",
+        # R13 = y, D = R14 = x
+        "@R13", "M=D",
+        "@SP", "AM=M-1", "D=M",
+        "@R14", "M=D",
+        f"@{x_neg}", "D;JLT",
+        # x >= 0, y < 0
+        "@R13", "D=M",
+        f"@{if_greater}", "D;JLT",
+        f"@{same_sign}", "0;JMP",
+        # x < 0, y >= 0
+        f"({x_neg})",
+        "@R13", "D=M",
+        f"@{if_less}", "D;JGE",
+        f"({same_sign})",
+        "@R14", "D=M",
+        "@R13", "D=D-M",
+        f"@{target}", jump,
+        f"({end})"
+    ]
+
+
+def move_argument_code(n_args: int, index: int) -> typing.List[str]:
+    """
+    Args:
+        n_args (int): the number of arguments on top of the stack.
+        index (int): one of them.
+
+    Returns:
+        typing.List[str]: code that copies the argument to ARG + index.
+    """
+    distance = n_args - index
+    if distance == 1:
+        load = ["@SP", "A=M-1", "D=M"]
+    else:
+        load = ["@SP", "D=M", f"@{distance}", "A=D-A", "D=M"]
+    if index == 0:
+        return load + ["@ARG", "A=M", "M=D"]
+    if index <= MAX_POP_STEPS:
+        return load + ["@ARG", "A=M+1"] + ["A=A+1"] * (index - 1) + ["M=D"]
+    return ["@ARG", "D=M", f"@{index}", "D=D+A", "@R13", "M=D"] + load + \
+        ["@R13", "A=M", "M=D"]
+
+
+# constant -> the computation that writes it to memory without loading it
+DIRECT_CONSTANTS = {0: "0", 1: "1", 0xFFFF: "-1"}
+
+
+def writes_d(lines: typing.List[str]) -> bool:
+    """
+    Args:
+        lines (typing.List[str]): assembly code.
+
+    Returns:
+        bool: whether the code changes the D register.
+    """
+    return any("D" in line.split("=", 1)[0] for line in lines if "=" in line)
+
+
+# Flush the output buffer once it holds this many characters
+BUFFER_SIZE = 1 << 16
+# How many distinct push/pop commands to keep translated
+TEMPLATE_CACHE_SIZE = 4096
+
+SEGMENT_BASES = {
+    "local": "LCL",
+    "argument": "ARG",
+    "this": "THIS",
+    "that": "THAT"
+}
+
+# Shared routines that call sites jump to instead of inlining the code.
+# Each one is written once, after all the translated files.
+ROUTINES = {
+    # D = return address, R13 = n_args, R14 = address of the callee
+    "$CALL": [
+        # push return address, LCL, ARG, THIS, THAT
+        "@SP", "A=M", "M=D",
+        "@LCL", "D=M", "@SP", "AM=M+1", "M=D",
+        "@ARG", "D=M", "@SP", "AM=M+1", "M=D",
+        "@THIS", "D=M", "@SP", "AM=M+1", "M=D",
+        "@THAT", "D=M", "@SP", "AM=M+1", "M=D",
+        "@SP", "MD=M+1",
+        # LCL = SP
+        "@LCL", "M=D",
+        # ARG = SP-5-n_args
+        "@R13", "D=D-M", "@5", "D=D-A", "@ARG", "M=D",
+        # goto callee
+        "@R14", "A=M", "0;JMP"
+    ],
+    "$RETURN": [
+        # R13 = frame = LCL, R14 = return address = *(frame-5)
+        "@LCL", "D=M", "@R13", "M=D",
+        "@5", "A=D-A", "D=M", "@R14", "M=D",
+        # *ARG = pop(), SP = ARG + 1
+        "@SP", "AM=M-1", "D=M", "@ARG", "A=M", "M=D",
+        "@ARG", "D=M+1", "@SP", "M=D",
+        # restore THAT, THIS, ARG, LCL from *(--frame)
+        "@R13", "AM=M-1", "D=M", "@THAT", "M=D",
+        "@R13", "AM=M-1", "D=M", "@THIS", "M=D",
+        "@R13", "AM=M-1", "D=M", "@ARG", "M=D",
+        "@R13", "AM=M-1", "D=M", "@LCL", "M=D",
+        # goto return address
+        "@R14", "A=M", "0;JMP"
+    ],
+}
+# Pushes R13 zeros (at least one), for the prologues of functions with many
+# locals: D = return address
+ROUTINES["$LOCALS"] = [
+    "@R15", "M=D",
+    "($LOCALS.LOOP)",
+    "@SP", "AM=M+1", "A=A-1", "M=0",
+    "@R13", "MD=M-1",
+    "@$LOCALS.LOOP", "D;JGT",
+    "@R15", "A=M", "0;JMP"
+]
+# How many ROM words one cycle per call is worth, when choosing how to
+# initialize the locals of a function (see locals_code)
+LOCALS_CYCLE_WEIGHT = 0.25
+# The comparisons, for size optimized code: R13 = y, D = return address and
+# x is on the stack. The result is returned in D.
+for _command in ("eq", "gt", "lt"):
+    ROUTINES[f"${_command.upper()}"] = \
+        ["@R15", "M=D", "@R13", "D=M"] + \
+        cached_comparison_code(_command, f"${_command.upper()}.") + \
+        ["@R15", "A=M", "0;JMP"]
+
+
+def block_locals_code(n_vars: int) -> typing.List[str]:
+    """Builds a prologue that stores n_vars zeros on the stack one after the
+    other, and moves SP past them once.
+
+    Args:
+        n_vars (int): the number of local variables, at least 1.
+
+    Returns:
+        typing.List[str]: the assembly code.
+    """
+    if n_vars == 1:
+        return ["@SP", "AM=M+1", "A=A-1", "M=0"]
+    return ["@SP", "A=M"] + ["M=0", "A=A+1"] * (n_vars - 1) + \
+        ["M=0", "D=A+1", "@SP", "M=D"]
+
+
+def loop_locals_code(n_vars: int, return_label: str) -> typing.List[str]:
+    """Builds a prologue that jumps to the shared $LOCALS routine.
+
+    Args:
+        n_vars (int): the number of local variables, at least 1.
+        return_label (str): the label that marks the return address.
+
+    Returns:
+        typing.List[str]: the assembly code.
+    """
+    return [f"@{n_vars}", "D=A", "@R13", "M=D",  # R13 = n_vars
+            f"@{return_label}", "D=A",  # D = return address
+            "@$LOCALS", "0;JMP",
+            f"({return_label})"]
+
+
+def use_locals_loop(n_vars: int) -> bool:
+    """The cost model of local variable initialization: the block store
+    takes 2 words and 2 cycles per local, the loop takes a few words at the
+    call site but a run of the loop body of the $LOCALS routine (8 cycles)
+    per local. Every cycle is weighed as LOCALS_CYCLE_WEIGHT words.
+
+    Args:
+        n_vars (int): the number of local variables, at least 1.
+
+    Returns:
+        bool: True if the loop is cheaper.
+    """
+    block = count_instructions(block_locals_code(n_vars))
+    site = loop_locals_code(n_vars, "r")
+    loop_words = count_instructions(site)
+    routine = ROUTINES["$LOCALS"]
+    loop = routine.index("($LOCALS.LOOP)")
+    end = routine.index("D;JGT") + 1
+    # the site, then the routine: its start, the loop body for every local
+    # and the return
+    loop_cycles = loop_words + count_instructions(routine[:loop]) + \
+        count_instructions(routine[loop:end]) * n_vars + \
+        count_instructions(routine[end:])
+    return loop_words + LOCALS_CYCLE_WEIGHT * loop_cycles < \
+        block + LOCALS_CYCLE_WEIGHT * block
+
+
+def count_instructions(lines: typing.List[str]) -> int:
+    """Counts the lines that take up ROM, i.e. skips labels and comments.
+
+    Args:
+        lines (typing.List[str]): assembly code.
+
+    Returns:
+        int: the number of instructions.
+    """
+    return sum(1 for line in lines if not line.startswith(("(", "//")))
+
 
 class CodeWriter:
     """Translates VM commands into Hack assembly code."""
 
-    def __init__(self, output_stream: typing.TextIO) -> None:
+    def __init__(self, output_stream: typing.TextIO,
+                 shared_frames: bool = False, buffer_size: int = BUFFER_SIZE,
+                 fd: typing.Optional[int] = None,
+                 template_cache_size: int = TEMPLATE_CACHE_SIZE,
+                 stack_cache: bool = False,
+                 fuse_branches: bool = False,
+                 shared_comparisons: bool = False,
+                 superinstructions: bool = False,
+                 tail_calls: bool = False,
+                 source_map: bool = False) -> None:
         """Initializes the CodeWriter.
 
         Args:
             output_stream (typing.TextIO): output stream.
+            shared_frames (bool): if this is True, call and return jump to the
+                shared $CALL and $RETURN routines instead of inlining the
+                whole frame protocol.
+            buffer_size (int): how many characters to hold before writing
+                them to the output in one block.
+            fd (int): if given, the output is written as bytes straight to
+                this file descriptor instead of to output_stream.
+            template_cache_size (int): how many translated push/pop commands
+                to remember, in least recently used order.
+            stack_cache (bool): if this is True, the top of the stack is
+                kept in D between commands when possible, and only written
+                back to the stack before labels, jumps, calls and returns.
+            fuse_branches (bool): if this is True, a comparison followed by
+                if-goto (with or without a "not" between them) jumps
+                straight to the label instead of pushing a boolean.
+            shared_comparisons (bool): if this is True, eq, gt and lt jump
+                to the shared $EQ, $GT and $LT routines instead of inlining
+                the whole comparison: smaller, but slower, code.
+            superinstructions (bool): if this is True, common sequences of
+                commands (see Fuser.py) are translated as a whole, reading
+                and writing memory directly instead of through the stack.
+            tail_calls (bool): if this is True, a call that is immediately
+                followed by a return reuses the frame of the caller.
+            source_map (bool): if this is True, the code of every command
+                and the entry point of every function are marked in the
+                output (see mark_source), for a SourceMapStream further down
+                the output to take out.
         """
 
         self.file = output_stream
+        self.fd = fd
+        self.buffer = []
+        self.buffered = 0
+        self.buffer_size = buffer_size
         self.filename = None
         self.label_counter = 0
         self.cur_function = None
+        # the registers saved by the inlined function body being written
+        self.inline_registers = ["LCL", "ARG"]
+        self.shared_frames = shared_frames
+        self.routines = set()
+        self.calls = 0
+        self.returns = 0
+        # the instructions written out so far, counted whenever the buffer is
+        # flushed (call flush() first for an exact count)
+        self.instructions = 0
+        self.merged_template_hits = 0
+        self.merged_template_misses = 0
+        self.return_code = "\n".join(self.inline_return_code()) + "\n"
+        self.stack_cache = stack_cache
+        # True while the top of the stack is in D and not on the stack
+        self.cached = False
+        self.fuse_branches = fuse_branches
+        # (comparison, negated) that is held back until the next command
+        # shows whether it can be fused into an if-goto
+        self.pending = None
+        self.shared_comparisons = shared_comparisons
+        # comparison -> how many were translated (not counting fused ones)
+        self.comparisons = collections.Counter()
+        self.superinstructions = superinstructions
+        # superinstruction -> how many were translated
+        self.fused = collections.Counter()
+        self.tail_calls = tail_calls
+        # how many tail calls were translated, and how many of them reuse
+        # the frame of the caller for sure (no run time check, see
+        # write_tail_call)
+        self.tail_call_sites = 0
+        self.reused_frames = 0
+        self.source_map = source_map
+        self.push_pop_code = functools.lru_cache(template_cache_size)(
+            self.build_cached_push_pop_code if stack_cache
+            else self.build_push_pop_code)
 
     def set_file_name(self, filename: str) -> None:
         """Informs the code writer that the translation of a new VM file is 
@@ -62,14 +604,97 @@ class CodeWriter:
         base_name = os.path.basename(filename)
         name_without_extension = os.path.splitext(base_name)[0]
         self.filename = name_without_extension
+        # Generated labels are prefixed with the file name, so every file can
+        # count them from 0 and be translated independently of the others
+        self.label_counter = 0
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: the statistics and the shared routines needed by the code
+            translated so far, in a form that can be stored and merged.
+        """
+        templates = self.push_pop_code.cache_info()
+        return {"routines": sorted(self.routines), "calls": self.calls,
+                "returns": self.returns,
+                "instructions": self.instructions,
+                "comparisons": dict(self.comparisons),
+                "fused": dict(self.fused),
+                "tail_call_sites": self.tail_call_sites,
+                "reused_frames": self.reused_frames,
+                "template_hits": templates.hits + self.merged_template_hits,
+                "template_misses":
+                    templates.misses + self.merged_template_misses}
+
+    def merge(self, stats: dict) -> None:
+        """Adds the statistics and the shared routines of another CodeWriter,
+        that translated other files of the same program, to this one.
+
+        Args:
+            stats (dict): what stats() returned for the other code writer.
+        """
+        self.routines.update(stats["routines"])
+        self.calls += stats["calls"]
+        self.returns += stats["returns"]
+        self.instructions += stats["instructions"]
+        self.comparisons.update(stats["comparisons"])
+        self.fused.update(stats["fused"])
+        self.tail_call_sites += stats["tail_call_sites"]
+        self.reused_frames += stats["reused_frames"]
+        self.merged_template_hits += stats["template_hits"]
+        self.merged_template_misses += stats["template_misses"]
+
+    def mark_source(self, line: typing.Optional[int],
+                    function: typing.Optional[str] = None) -> None:
+        """Marks where the code of a command starts, with a comment that a
+        SourceMapStream takes out of the output again. The code lasts until
+        the next mark.
+
+        Args:
+            line (int): the line of the command in the current file, or None
+                for code of no command.
+            function (str): what to call the function of the code, the
+                current function by default.
+        """
+        filename = self.filename if line is not None else ""
+        self.write_text(f"{MARK}\t{filename}\t{line or 0}\t"
+                        f"{function or self.cur_function or ''}\n")
 
     def write_line(self, lines):
         if isinstance(lines, str):
-            # single line
-            self.file.write(lines + "\n")
+            # single line, or a block of lines that is already joined
+            self.write_text(lines + "\n")
         else:
-            for line in lines:
-                self.file.write(line + "\n")
+            self.write_text("\n".join(lines) + "\n")
+
+    def write_text(self, text: str) -> None:
+        """Adds newline terminated assembly code to the output buffer, and
+        writes the buffer out once it is full.
+
+        Args:
+            text (str): the code.
+        """
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes everything in the output buffer to the output. Should be
+        called before anything else writes to the output stream.
+        """
+        text = "".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        # every line but the labels and comments takes a word of ROM
+        self.instructions += text.count("\n") - text.count("\n(") - \
+            text.startswith("(") - text.count("//")
+        if self.fd is None:
+            self.file.write(text)
+            return
+        data = memoryview(text.encode())
+        while data:
+            data = data[os.write(self.fd, data):]
 
     def write_arithmetic(self, command: str) -> None:
         """Writes assembly code that is the translation of the given 
@@ -80,137 +705,148 @@ class CodeWriter:
         Args:
             command (str): an arithmetic command.
         """
-        if command in binary:
-            self.write_line([
-                f"// binary operation: {command}",
-                # pop y into D
-                "@SP",
-                "M=M-1",
-                "A=M",
-                "D=M",
-                # pop x and apply operation with D
-                "@SP",
-                "M=M-1",
-                "A=M",
-                binary[command],  # M=M+D, M=M-D, M=M&D, M=M|D
-                # push result (increment SP)
-                "@SP",
-                "M=M+1"])
-        elif command in unary:
-            self.write_line([
-                f"// unary operation: {command}",
-                # access top of stack (SP-1)
-                "@SP",
-                "A=M-1",
-                # apply the operator in-place
-                unary[command]])  # M=-M or M=!M
+        if self.fuse_branches:
+            if command in COMPARISON_TEMPLATES:
+                self.write_pending()
+                self.pending = (command, False)
+                return
+            if command == "not" and self.pending is not None:
+                self.pending = (self.pending[0], not self.pending[1])
+                return
+            self.write_pending()
+        self.write_operation(command)
+
+    def write_operation(self, command: str) -> None:
+        """Writes an arithmetic command on its own, without fusing it.
 
+        Args:
+            command (str): an arithmetic command.
+        """
+        if command in COMPARISON_TEMPLATES:
+            self.comparisons[command] += 1
+            if self.shared_comparisons:
+                self.write_shared_comparison(command)
+                return
+        if self.stack_cache:
+            self.write_cached_arithmetic(command)
+        elif command in binary:
+            self.write_text(BINARY_CODE[command])
+        elif command in unary:
+            self.write_text(UNARY_CODE[command])
 
-        elif command == "eq":
-            # Handle equality comparison: true if x == y, false otherwise
+        elif command in COMPARISON_TEMPLATES:
+            # The labels must be unique, so the only thing left to fill in
+            # the template is their prefix
             label_id = self.label_counter
             self.label_counter += 1
-            true_label = f"EQ_{label_id}_TRUE"
-            end_label = f"EQ_{label_id}_END"
-
-            self.write_line([
-                "// comparison: eq",
-                # Pop y into D
-                "@SP", "M=M-1", "A=M", "D=M",
-                # Pop x and compute x - y
-                "@SP", "M=M-1", "A=M", "D=M-D",
-                # If result is zero -> x == y
-                f"@{true_label}", "D;JEQ",
-                # False case: write 0
-                "@SP", "A=M", "M=0",
-                f"@{end_label}", "0;JMP",
-                # True case: write -1
-                f"({true_label})",
-                "@SP", "A=M", "M=-1",
-                # Finish: increment SP
-                f"({end_label})",
-                "@SP", "M=M+1"
-            ])
-
-        elif command in ("gt", "lt"):
-            # Handle signed greater-than / less-than in a way that avoids overflow
+            self.write_line(COMPARISON_TEMPLATES[command].format(
+                f"{self.filename}.{command.upper()}_{label_id}_"))
+        else:
+            raise ValueError(f"Unknown command: {command}")
+
+    def write_cached_arithmetic(self, command: str) -> None:
+        """Writes an arithmetic command for the top-of-stack cache: the
+        operands are popped from D and the stack, and the result is left in D.
+
+        Args:
+            command (str): an arithmetic command.
+        """
+        if not self.cached:
+            self.write_text(POP_D_CODE)
+        if command in CACHED_BINARY_CODE:
+            self.write_text(CACHED_BINARY_CODE[command])
+        elif command in CACHED_UNARY_CODE:
+            self.write_text(CACHED_UNARY_CODE[command])
+        elif command in CACHED_COMPARISON_TEMPLATES:
             label_id = self.label_counter
             self.label_counter += 1
+            self.write_line(CACHED_COMPARISON_TEMPLATES[command].format(
+                f"{self.filename}.{command.upper()}_{label_id}_"))
+        else:
+            raise ValueError(f"Unknown command: {command}")
+        self.cached = True
 
-            prefix = f"{command.upper()}_{label_id}_"
-            x_neg = f"{prefix}X_NEG"
-            same_sign = f"{prefix}SAME_SIGN"
-            x_pos_y_neg = f"{prefix}X_POS_Y_NEG"
-            x_neg_y_non_neg = f"{prefix}X_NEG_Y_NON_NEG"
-            true_label = f"{prefix}TRUE"
-            end_label = f"{prefix}END"
+    def write_shared_comparison(self, command: str) -> None:
+        """Writes a comparison that jumps to the shared routine of its kind.
 
-            code = [
-                f"// comparison: {command}",
-                # Pop y into R13
-                "@SP", "M=M-1", "A=M", "D=M",
-                "@R13", "M=D",
-                # Pop x into R14
-                "@SP", "M=M-1", "A=M", "D=M",
-                "@R14", "M=D",
-
-                # Check sign of x
-                "@R14", "D=M",
-                f"@{x_neg}", "D;JLT",  # If x < 0 -> go to X_NEG
-
-                # Here x >= 0, now check sign of y
-                "@R13", "D=M",
-                f"@{x_pos_y_neg}", "D;JLT",  # If y < 0 -> x>=0,y<0
-                f"@{same_sign}", "0;JMP",  # Otherwise: same sign
-
-                # X_NEG: x < 0, now check sign of y
-                f"({x_neg})",
-                "@R13", "D=M",
-                f"@{x_neg_y_non_neg}", "D;JGE",  # If y >= 0 -> x<0,y>=0
-                f"@{same_sign}", "0;JMP",  # Otherwise: both negative -> same sign
-
-                # Case: x>=0, y<0 (different signs)
-                f"({x_pos_y_neg})",
-            ]
+        Args:
+            command (str): "eq", "gt" or "lt".
+        """
+        self.routines.add(f"${command.upper()}")
+        label_id = self.label_counter
+        self.label_counter += 1
+        code = [] if self.cached else [POP_D_CODE.rstrip()]
+        code += self.shared_comparison_code(
+            command, f"{self.filename}.{command.upper()}_{label_id}_RET")
+        if self.stack_cache:
+            self.cached = True
+        else:
+            code.append(SPILL_CODE.rstrip())
+        self.write_line(code)
 
-            if command == "gt":
-                # For gt: x>=0,y<0 => always true
-                code += ["@SP", "A=M", "M=-1", f"@{end_label}", "0;JMP"]
-            else:
-                # For lt: x>=0,y<0 => always false
-                code += ["@SP", "A=M", "M=0", f"@{end_label}", "0;JMP"]
+    @staticmethod
+    def shared_comparison_code(command: str,
+                               return_label: str) -> typing.List[str]:
+        """Returns a comparison site that jumps to the shared routine, with
+        y in D before it and the result in D after it.
 
-            # Case: x<0, y>=0 (different signs)
-            code += [
-                f"({x_neg_y_non_neg})",
-            ]
+        Args:
+            command (str): "eq", "gt" or "lt".
+            return_label (str): the label that marks the return address.
+
+        Returns:
+            typing.List[str]: the assembly code of the site.
+        """
+        return ["@R13", "M=D",  # R13 = y
+                f"@{return_label}", "D=A",  # D = return address
+                f"@${command.upper()}", "0;JMP",
+                f"({return_label})"]
+
+    def comparison_rom(self, shared: bool) -> int:
+        """Estimates the ROM taken by the comparisons translated so far.
 
-            if command == "gt":
-                # For gt: x<0,y>=0 => always false
-                code += ["@SP", "A=M", "M=0", f"@{end_label}", "0;JMP"]
+        Args:
+            shared (bool): whether to count them as jumps to the shared
+                routines, or as inlined comparisons.
+
+        Returns:
+            int: the number of instructions.
+        """
+        total = 0
+        for command, count in self.comparisons.items():
+            if shared:
+                site = count_instructions(
+                    self.shared_comparison_code(command, "r"))
+                if not self.stack_cache:
+                    site += 7  # popping y and pushing the result
+                total += count * site + \
+                    count_instructions(ROUTINES[f"${command.upper()}"])
             else:
-                # For lt: x<0,y>=0 => always true
-                code += ["@SP", "A=M", "M=-1", f"@{end_label}", "0;JMP"]
-
-            # Same-sign case: now it is safe to use x - y
-            code += [
-                f"({same_sign})",
-                "@R14", "D=M",  # D = x
-                "@R13", "D=D-M",  # D = x - y
-                f"@{true_label}", "D;JGT" if command == "gt" else "D;JLT",
-                # False case
-                "@SP", "A=M", "M=0",
-                f"@{end_label}", "0;JMP",
-                # True case
-                f"({true_label})",
-                "@SP", "A=M", "M=-1",
-                # Finish: increment SP
-                f"({end_label})",
-                "@SP", "M=M+1"
-            ]
-            self.write_line(code)
-        else:
-            raise ValueError(f"Unknown command: {command}")
+                templates = CACHED_COMPARISON_TEMPLATES if self.stack_cache \
+                    else COMPARISON_TEMPLATES
+                total += count * count_instructions(
+                    templates[command].splitlines())
+        return total
+
+    def write_pending(self) -> None:
+        """Writes the comparison held back for fusing, as an ordinary one."""
+        if self.pending is None:
+            return
+        command, negated = self.pending
+        self.pending = None
+        self.write_operation(command)
+        if negated:
+            self.write_operation("not")
+
+    def spill(self) -> None:
+        """Writes the top of the stack back to the stack, if it is held in
+        D. Must be called before anything that expects the whole stack in
+        RAM: labels, jumps, calls and returns.
+        """
+        self.write_pending()
+        if self.cached:
+            self.write_text(SPILL_CODE)
+            self.cached = False
 
     def write_push_pop(self, command: str, segment: str, index: int) -> None:
         """Writes assembly code that is the translation of the given 
@@ -226,48 +862,202 @@ class CodeWriter:
         # be translated to the assembly symbol "Xxx.i". In the subsequent
         # assembly process, the Hack assembler will allocate these symbolic
         # variables to the RAM, starting at address 16.
+        # Static variables are named after the file, so it is part of the key
+        self.write_pending()
+        filename = self.filename if segment == "static" else None
+        if self.stack_cache:
+            self.write_text(self.push_pop_code(
+                command, segment, index, filename, self.cached))
+            self.cached = command == "C_PUSH"
+        else:
+            self.write_text(self.push_pop_code(command, segment, index, filename))
+
+    def build_push_pop_code(self, command: str, segment: str, index: int,
+                            filename: typing.Optional[str]) -> str:
+        """Translates a push or pop command. Only called when the command
+        is not in the template cache yet.
+
+        Args:
+            command (str): "C_PUSH" or "C_POP".
+            segment (str): the memory segment to operate on.
+            index (int): the index in the memory segment.
+            filename (str): the file of static variables, None for the other
+                segments (only used as part of the cache key).
+
+        Returns:
+            str: the newline terminated assembly code.
+        """
         if command == "C_PUSH":
             # 1. Get the value into D according to the segment and index
             code = self.getAddressCode(segment, index, for_pop=False)
             # 2. Push D onto the stack
-            self.write_line(code + [
-                "@SP",  # A = address of the stack pointer
-                "A=M",  # A = top of the stack
-                "M=D",  # *SP = D (store value on top of stack)
-                "@SP",
-                "M=M+1"  # SP++
-            ])
+            code.append(PUSH_CODE)
 
         elif command == "C_POP":
             # 1. Compute the target address for the segment[index]
             code = self.getAddressCode(segment, index, for_pop=True)
-            self.write_line(code + [
-                "D=A",  # D = computed address
-                "@R13",  # use R13 as a temporary register
-                "M=D",  # R13 = target address
-
-                # 2. Pop the top value from the stack into D
-                "@SP",
-                "M=M-1",  # SP--
-                "A=M",  # A = new top of stack
-                "D=M",  # D = *SP (popped value)
-
-                # 3. Write D to the target address stored in R13
-                "@R13",
-                "A=M",  # A = target address
-                "M=D"  # *addr = D
-            ])
+            # 2. Pop the top value into it, through R13
+            code.append(POP_CODE)
+        else:
+            raise ValueError(f"Unknown command: {command}")
+        return "\n".join(code) + "\n"
+
+    def build_cached_push_pop_code(self, command: str, segment: str,
+                                   index: int, filename: typing.Optional[str],
+                                   cached: bool) -> str:
+        """Translates a push or pop command for the top-of-stack cache. A
+        push loads the value into D, a pop stores D.
+
+        Args:
+            command (str): "C_PUSH" or "C_POP".
+            segment (str): the memory segment to operate on.
+            index (int): the index in the memory segment.
+            filename (str): the file of static variables, None for the other
+                segments (only used as part of the cache key).
+            cached (bool): whether the top of the stack is in D before the
+                command.
+
+        Returns:
+            str: the newline terminated assembly code.
+        """
+        if command == "C_PUSH":
+            # the value in D makes room for the new one
+            code = [SPILL_CODE] if cached else []
+            code += self.getAddressCode(segment, index, for_pop=False)
+        elif command == "C_POP":
+            code = [] if cached else [POP_D_CODE]
+            if segment in SEGMENT_BASES and index <= MAX_POP_STEPS:
+                code += [f"@{SEGMENT_BASES[segment]}", "A=M"] + \
+                    ["A=A+1"] * index
+            elif segment in SEGMENT_BASES:
+                # R13 = value, R14 = address
+                code += ["@R13", "M=D",
+                         f"@{SEGMENT_BASES[segment]}", "D=M",
+                         f"@{index}", "D=D+A",
+                         "@R14", "M=D",
+                         "@R13", "D=M",
+                         "@R14", "A=M"]
+            else:
+                code += self.getAddressCode(segment, index, for_pop=True)
+            code.append("M=D")
+        else:
+            raise ValueError(f"Unknown command: {command}")
+        return "".join(line if line.endswith("\n") else line + "\n"
+                       for line in code)
+
+    def write_fused(self, name: str, commands: list) -> None:
+        """Writes a sequence of commands that was fused into a single
+        superinstruction (see Fuser.py). The stack is left as the commands
+        would have left it, without being touched.
+
+        Args:
+            name (str): the pattern that matched.
+            commands (list): the commands of the sequence.
+        """
+        self.write_pending()
+        if name == "copy":
+            source, target = commands
+            stored = target.arg1
+            code = self.copy_code(source.arg1, source.arg2,
+                                  target.arg1, target.arg2)
+        elif name == "increment":
+            variable, step, operation, _ = commands
+            stored = variable.arg1
+            code = self.increment_code(variable.arg1, variable.arg2,
+                                       "+" if operation.arg1 == "add" else "-",
+                                       step.arg2)
+        else:
+            raise ValueError(f"Unknown superinstruction: {name}")
+        # the top of the stack may stay in D, if the code leaves D alone and
+        # stores where the stack cannot be: the segments based on pointers
+        # may point at the stack slot D is spilled to later (e.g. the locals
+        # of an inlined body start at SP), which would undo the store
+        if self.cached and (writes_d(code) or stored in SEGMENT_BASES):
+            self.spill()
+        self.fused[name] += 1
+        self.write_line(code)
+
+    def address_code(self, segment: str, index: int,
+                     keep_d: bool) -> typing.Optional[typing.List[str]]:
+        """
+        Args:
+            segment (str): a memory segment, not "constant".
+            index (int): the index in the memory segment.
+            keep_d (bool): whether D must keep its value.
+
+        Returns:
+            typing.List[str]: code that points A at segment[index], or None
+            if that cannot be done cheaply without changing D.
+        """
+        if segment not in SEGMENT_BASES:
+            return self.getAddressCode(segment, index, for_pop=True)
+        base = SEGMENT_BASES[segment]
+        # stepping takes 2 + index instructions, adding the index takes 4
+        if index <= (MAX_POP_STEPS if keep_d else 2):
+            return [f"@{base}", "A=M"] + ["A=A+1"] * index
+        if keep_d:
+            return None
+        return [f"@{index}", "D=A", f"@{base}", "A=D+M"]
+
+    def store_code(self, segment: str, index: int,
+                   value: typing.List[str], operation: str) -> typing.List[str]:
+        """
+        Args:
+            segment (str): a memory segment, not "constant".
+            index (int): the index in the memory segment.
+            value (typing.List[str]): code that loads a value into D.
+            operation (str): the computation that stores the value at
+                segment[index], e.g. "M=D" or "M=M+D".
+
+        Returns:
+            typing.List[str]: the code.
+        """
+        address = self.address_code(segment, index, keep_d=True)
+        if address is not None:
+            return value + address + [operation]
+        # R13 = the address, computed before D is taken by the value
+        return [f"@{SEGMENT_BASES[segment]}", "D=M", f"@{index}", "D=D+A",
+                "@R13", "M=D"] + value + ["@R13", "A=M", operation]
+
+    def copy_code(self, source: str, source_index: int, target: str,
+                  target_index: int) -> typing.List[str]:
+        """
+        Returns:
+            typing.List[str]: the code of "push source source_index / pop
+            target target_index", from memory to memory.
+        """
+        if source == "constant" and source_index in DIRECT_CONSTANTS:
+            return self.address_code(target, target_index, keep_d=False) + \
+                [f"M={DIRECT_CONSTANTS[source_index]}"]
+        if source == "constant":
+            value = self.getAddressCode(source, source_index)
+        else:
+            value = self.address_code(source, source_index, keep_d=False) + \
+                ["D=M"]
+        return self.store_code(target, target_index, value, "M=D")
+
+    def increment_code(self, segment: str, index: int, sign: str,
+                       step: int) -> typing.List[str]:
+        """
+        Returns:
+            typing.List[str]: the code of "segment[index] += step" (or -=,
+            by sign), in place.
+        """
+        if step == 1:
+            return self.address_code(segment, index, keep_d=False) + \
+                [f"M=M{sign}1"]
+        return self.store_code(segment, index, [f"@{step}", "D=A"],
+                               f"M=M{sign}D")
 
     def getAddressCode(self, segment, index, for_pop=False):
-        base_segments = {
-            "local": "LCL",
-            "argument": "ARG",
-            "this": "THIS",
-            "that": "THAT"
-        }
+        base_segments = SEGMENT_BASES
 
         # constant
         if segment == "constant":
+            # A-instructions only hold 15 bits: larger words (the negative
+            # results of constant folding) are loaded through their complement
+            if index > 0x7FFF:
+                return [f"@{~index & 0xFFFF}", "D=!A"]
             return [f"@{index}", "D=A"]
 
         # base segments
@@ -305,15 +1095,49 @@ class CodeWriter:
                 code.append("D=M")
             return code
 
+        raise ValueError(f"Unknown segment: {segment}")
+
+    def write_routines(self) -> None:
+        """Writes the shared routines used by the translated code. Should be
+        called once, after the last file was translated.
+        """
+        self.spill()
+        if not self.routines:
+            return
+        if self.source_map:
+            self.mark_source(None, "(routines)")
+        # The routines are only reached by jumps, never fall into them
+        self.write_line(["($END)", "@$END", "0;JMP"])
+        for name in sorted(self.routines):
+            self.write_line([f"({name})"] + ROUTINES[name])
+
+    def shared_frames_savings(self) -> int:
+        """
+        Returns:
+            int: how many instructions the shared $CALL and $RETURN routines
+            saved, compared with inlining the frame protocol at every site.
+        """
+        call_site = count_instructions(self.inline_call_code("f", 0, "r")) - \
+            count_instructions(self.shared_call_code("f", 0, "r"))
+        return_site = count_instructions(self.inline_return_code()) - 2
+        overhead = sum(count_instructions(ROUTINES[name])
+                       for name in ("$CALL", "$RETURN") if name in self.routines)
+        if overhead:
+            overhead += 2  # the $END guard in front of the routines
+        return self.calls * call_site + self.returns * return_site - overhead
+
     def close(self):
+        self.flush()
         if self.file is not None:
             self.file.close()
 
     def write_init(self) -> None:
+        if self.source_map:
+            self.mark_source(None, "(bootstrap)")
         # 1. SP = 256
         self.write_line(["@256", "D=A", "@SP", "M=D"])
         # 2. Call Sys.init
-        self.write_call("Sys.init", 0)
+        self.write_call("Sys.init", 0, "$bootstrap$ret")
 
     def write_label(self, label: str) -> None:
         """Writes assembly code that affects the label command. 
@@ -329,6 +1153,7 @@ class CodeWriter:
         # This is irrelevant for project 7,
         # you will implement this in project 8!
 
+        self.spill()
         # if we are not in any function
         if not self.cur_function:
             self.write_line(f"({label})")
@@ -343,6 +1168,7 @@ class CodeWriter:
         """
         # This is irrelevant for project 7,
         # you will implement this in project 8!
+        self.spill()
         if not self.cur_function:
             self.write_line([f"@{label}", "0;JMP"])
         else:
@@ -357,13 +1183,23 @@ class CodeWriter:
         # This is irrelevant for project 7,
         # you will implement this in project 8!
 
-        self.write_line(["@SP", "M=M-1", "A=M", "D=M"])
+        if self.cur_function:
+            label = f"{self.cur_function}${label}"
         # pop = now D holds zero or non-zero depends on the top value of the stack
-
-        if not self.cur_function:
-            self.write_line([f"@{label}", "D;JNE"])
+        # (unless it is there already)
+        pop = [] if self.cached else [IF_POP_CODE]
+        self.cached = False
+        if self.pending is not None:
+            # the comparison before jumps by itself
+            command, negated = self.pending
+            self.pending = None
+            label_id = self.label_counter
+            self.label_counter += 1
+            self.write_line(pop + compare_branch_code(
+                command, negated, label,
+                f"{self.filename}.IF_{command.upper()}_{label_id}_"))
         else:
-            self.write_line([f"@{self.cur_function}${label}", "D;JNE"])
+            self.write_line(pop + [f"@{label}", "D;JNE"])
 
     def write_function(self, function_name: str, n_vars: int) -> None:
         """Writes assembly code that affects the function command. 
@@ -380,18 +1216,28 @@ class CodeWriter:
         # This is irrelevant for project 7,
         # you will implement this in project 8!
 
+        # Nothing can be held in D across the entry point
+        self.spill()
+
         # Update current function name for future labels/goto commands
         self.cur_function = function_name
+        if self.source_map:
+            self.write_text(f"{ENTRY_MARK}\t{function_name}\n")
 
         # (function_name) = Write the function entry label
         self.write_line(f"({function_name})")
 
-        # Initialize local variables to 0
-        # repeat n_vars times (NUMBER OF LOCAL VARS):
-        for i in range(n_vars):
-            self.write_push_pop("C_PUSH", "constant", 0)
+        # Initialize local variables to 0, all at once
+        if not n_vars:
+            return
+        if use_locals_loop(n_vars):
+            self.routines.add("$LOCALS")
+            self.write_line(loop_locals_code(n_vars, f"{function_name}$locals"))
+        else:
+            self.write_line(block_locals_code(n_vars))
 
-    def write_call(self, function_name: str, n_args: int) -> None:
+    def write_call(self, function_name: str, n_args: int,
+                   return_label: typing.Optional[str] = None) -> None:
         """Writes assembly code that affects the call command. 
         Let "Xxx.foo" be a function within the file Xxx.vm.
         The handling of each "call" command within Xxx.foo's code generates and
@@ -406,6 +1252,8 @@ class CodeWriter:
         Args:
             function_name (str): the name of the function to call.
             n_args (int): the number of arguments of the function.
+            return_label (str): the return address label to use instead of
+                generating one.
         """
         # This is irrelevant for project 7,
         # you will implement this in project 8!
@@ -414,53 +1262,202 @@ class CodeWriter:
         # push return_address   // generates a label and pushes it to the stack
 
         # 1. Push return address (Using D=A because it's a label/constant)
-        return_label = f"{self.filename}$ret.{self.label_counter}"
-        self.label_counter += 1
+        if return_label is None:
+            return_label = f"{self.filename}$ret.{self.label_counter}"
+            self.label_counter += 1
+        self.calls += 1
+        self.spill()
+
+        if self.shared_frames:
+            # Only load the arguments of the frame protocol and jump to the
+            # shared $CALL routine, which does the rest
+            self.routines.add("$CALL")
+            self.write_line(self.shared_call_code(function_name, n_args, return_label))
+        else:
+            self.write_line(self.inline_call_code(function_name, n_args, return_label))
 
-        self.write_line([
-                            f"@{return_label}",
-                            "D=A"] +  # Load the address number into D
-                        PUSH  # Push D to stack
-                        )
+        # (return_address)      // injects the return address label into the code
+        self.write_line(f"({return_label})")
+
+    def write_tail_call(self, function_name: str, n_args: int) -> None:
+        """Writes a call that is immediately followed by a return, so that
+        the callee takes over the frame of the caller: its arguments are
+        moved over the caller's, LCL and ARG stay, and the callee returns
+        straight to the caller's caller, through the frame the caller's
+        caller saved. Tail recursion runs in constant stack space.
+
+        This needs room for the arguments below the saved frame, i.e. the
+        caller must have had at least n_args arguments itself (ARG + n_args
+        <= LCL - 5). Otherwise the code falls back to a usual call and
+        return.
+
+        Args:
+            function_name (str): the name of the function to call.
+            n_args (int): the number of arguments of the function.
+        """
+        self.spill()
+        self.tail_call_sites += 1
+        code = []
+        fallback = None
+        if not n_args:
+            self.reused_frames += 1
+        else:
+            fallback = f"{self.filename}$tail.{self.label_counter}"
+            self.label_counter += 1
+            code += ["@LCL", "D=M", "@ARG", "D=D-M", f"@{n_args + 5}",
+                     "D=D-A", f"@{fallback}", "D;JLT"]
+        # The arguments are moved down, first to last, so none of them is
+        # overwritten before it is moved
+        for index in range(n_args):
+            code += move_argument_code(n_args, index)
+        # SP = LCL, the callee pushes its locals there
+        code += ["@LCL", "D=M", "@SP", "M=D", f"@{function_name}", "0;JMP"]
+        self.write_line(code)
+        if fallback is not None:
+            self.write_line(f"({fallback})")
+            self.write_call(function_name, n_args)
+            self.write_return()
+
+    def inline_call_code(self, function_name: str, n_args: int,
+                         return_label: str) -> typing.List[str]:
+        """Returns the full frame protocol of a call command.
+
+        Args:
+            function_name (str): the name of the function to call.
+            n_args (int): the number of arguments of the function.
+            return_label (str): the label that marks the return address.
+
+        Returns:
+            typing.List[str]: the assembly code of the call, without the
+            return address label itself.
+        """
+        code = [f"@{return_label}",
+                "D=A"] + PUSH  # Load the address number into D and push it
 
         # 2. Push LCL, ARG, THIS, THAT (Using D=M because we want the stored value)
         for segment in ["LCL", "ARG", "THIS", "THAT"]:
-            self.write_line([
-                                f"@{segment}",
-                                "D=M"] +  # Load the value stored in the register into D
-                            PUSH  # Push D to stack
-                            )
+            code += [f"@{segment}",
+                     "D=M"] + PUSH  # Load the value stored in the register into D
 
         # ARG = SP-5-n_args     // repositions ARG
-        self.write_line([f"@{n_args}", "D=A", "@5", "D=A+D", "@SP", "D=M-D", "@ARG", "M=D"])
+        code += [f"@{n_args}", "D=A", "@5", "D=A+D", "@SP", "D=M-D", "@ARG", "M=D"]
         # LCL = SP              // repositions LCL
-        self.write_line(["@SP", "D=M", "@LCL", "M=D"])
+        code += ["@SP", "D=M", "@LCL", "M=D"]
 
         # goto function_name    // transfers control to the callee
-        self.write_line([f"@{function_name}", "0;JMP"])
+        code += [f"@{function_name}", "0;JMP"]
+        return code
 
-        # (return_address)      // injects the return address label into the code
-        self.write_line(f"({return_label})")
+    def shared_call_code(self, function_name: str, n_args: int,
+                         return_label: str) -> typing.List[str]:
+        """Returns a call site that jumps to the shared $CALL routine.
+
+        Args:
+            function_name (str): the name of the function to call.
+            n_args (int): the number of arguments of the function.
+            return_label (str): the label that marks the return address.
+
+        Returns:
+            typing.List[str]: the assembly code of the call site.
+        """
+        return [
+            f"@{n_args}", "D=A", "@R13", "M=D",  # R13 = n_args
+            f"@{function_name}", "D=A", "@R14", "M=D",  # R14 = callee
+            f"@{return_label}", "D=A",  # D = return address
+            "@$CALL", "0;JMP"
+        ]
 
     def write_return(self) -> None:
         """Writes assembly code that affects the return command."""
         # This is irrelevant for project 7,
         # you will implement this in project 8!
 
+        self.returns += 1
+        self.spill()
+        if self.shared_frames:
+            self.routines.add("$RETURN")
+            self.write_line(["@$RETURN", "0;JMP"])
+        else:
+            self.write_text(self.return_code)
+
+    def write_inline(self, function_name: str, n_args: int,
+                     pointers: bool, n_vars: int = 0) -> None:
+        """Writes the light frame of an inlined function body (see
+        Inliner.py): saves the registers of the caller, repositions ARG and
+        LCL, without a return address, and zeroes the locals like
+        write_function does, so they are in RAM before the body runs. The
+        body itself is written as ordinary commands.
+
+        Args:
+            function_name (str): the name of the inlined function.
+            n_args (int): the number of arguments of the call.
+            pointers (bool): if this is True, the body changes THIS and THAT,
+                so they are saved as well.
+            n_vars (int): the number of local variables of the function.
+        """
+        self.spill()
+        self.inline_registers = ["LCL", "ARG"] + \
+            (["THIS", "THAT"] if pointers else [])
+        code = [f"// inline call {function_name} {n_args}"]
+        for register in self.inline_registers:
+            code += [f"@{register}", "D=M", f"@$inline.{register}", "M=D"]
+        # LCL = SP, ARG = SP-n_args
+        code += ["@SP", "D=M", "@LCL", "M=D", f"@{n_args}", "D=D-A", "@ARG", "M=D"]
+        if n_vars and use_locals_loop(n_vars):
+            self.routines.add("$LOCALS")
+            code += loop_locals_code(
+                n_vars, f"{self.filename}$locals.{self.label_counter}")
+            self.label_counter += 1
+        elif n_vars:
+            code += block_locals_code(n_vars)
+        self.write_line(code)
+
+    def write_inline_return(self, end_label: typing.Optional[str]) -> None:
+        """Writes a return from an inlined function body.
+
+        Args:
+            end_label (str): the end of the body, or None if the return is
+                the last command of the body and falls through to it.
+        """
+        self.write_pending()
+        # *ARG = pop(), SP = ARG+1
+        code = [] if self.cached else ["@SP", "AM=M-1", "D=M"]
+        self.cached = False
+        code += ["@ARG", "A=M", "M=D", "@ARG", "D=M+1", "@SP", "M=D"]
+        for register in self.inline_registers:
+            code += [f"@$inline.{register}", "D=M", f"@{register}", "M=D"]
+        self.write_line(code)
+        if end_label is not None:
+            self.write_goto(end_label)
+
+    def write_inline_end(self, end_label: str) -> None:
+        """Writes the end of an inlined function body.
+
+        Args:
+            end_label (str): the label that the returns of the body go to.
+        """
+        self.write_label(end_label)
+
+    def inline_return_code(self) -> typing.List[str]:
+        """Returns the full frame protocol of a return command.
+
+        Returns:
+            typing.List[str]: the assembly code of the return.
+        """
         # frame = LCL                   // frame is a temporary variable
-        self.write_line(["@LCL",
-                         "D=M",
-                         "@frame",
-                         "M=D"])
+        code = ["@LCL",
+                "D=M",
+                "@frame",
+                "M=D"]
 
         # return_address = *(frame-5)   // puts the return address in a temp var
-        self.write_line(["@5", "D=A", "@frame", "A=M", "A=A-D", "D=M", "@return_address", "M=D"])
+        code += ["@5", "D=A", "@frame", "A=M", "A=A-D", "D=M", "@return_address", "M=D"]
 
         # *ARG = pop()                  // repositions the return value for the caller
-        self.write_line(["@SP", "M=M-1", "A=M", "D=M", "@ARG", "A=M", "M=D"])
+        code += ["@SP", "M=M-1", "A=M", "D=M", "@ARG", "A=M", "M=D"]
 
         # SP = ARG + 1                  // repositions SP for the caller
-        self.write_line(["@ARG", "D=M", "@SP", "M=D+1"])
+        code += ["@ARG", "D=M", "@SP", "M=D+1"]
 
         # # THAT = *(frame-1)             // restores THAT for the caller
         # # THIS = *(frame-2)             // restores THIS for the caller
@@ -469,10 +1466,10 @@ class CodeWriter:
         indexes = [1, 2, 3, 4]
         locations = ["THAT", "THIS", "ARG", "LCL"]
         for index, location in zip(indexes, locations):
-            self.write_line(["@frame", "D=M", f"@{index}", "A=D-A", "D=M", f"@{location}", "M=D"])
+            code += ["@frame", "D=M", f"@{index}", "A=D-A", "D=M", f"@{location}", "M=D"]
 
         # goto return_address           // go to the return address
-        self.write_line(["@return_address", "A=M", "0;JMP"])
+        code += ["@return_address", "A=M", "0;JMP"]
 
         # # 1. FRAME = LCL (Save LCL to R13)
         # self.write_line(["@LCL", "D=M", "@R13", "M=D"])
@@ -508,3 +1505,4 @@ class CodeWriter:
         #
         # # 6. goto RET (Jump to the return address stored in R14)
         # self.write_line(["@R14", "A=M", "0;JMP"])
+        return code
@@ -0,0 +1,180 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import signal
+import traceback
+import typing
+import Main
+from Cache import MemoryCache
+from Client import DEFAULT_SOCKET
+
+# How often to look for changed input files, in seconds
+POLL_INTERVAL = 0.5
+# How many recent requests to keep translated as their inputs change
+MAX_WATCHED = 16
+
+
+class Daemon:
+    """Translates in a single long-running process, for requests that come
+    in over a Unix socket (see Client.py).
+
+    The parsed commands and the translated fragment of every file stay in
+    memory, so a request only retranslates the files that changed since
+    the last one. The inputs of recent requests are also polled, and
+    retranslated in the background as soon as they change, so that the
+    next request finds everything up to date.
+
+    The protocol is a single JSON line each way: {"cwd", "argv"} with the
+    options of Main.py, then {"status", "stdout", "stderr"}.
+    """
+
+    def __init__(self, socket_path: str, cache_size: int,
+                 poll_interval: float = POLL_INTERVAL) -> None:
+        """Initializes the daemon.
+
+        Args:
+            socket_path (str): where to listen.
+            cache_size (int): the size limit of the translated fragments.
+            poll_interval (float): how often to look for changed files.
+        """
+        self.socket_path = socket_path
+        self.poll_interval = poll_interval
+        self.cache = MemoryCache(cache_size)
+        # path -> ((modification time, size), commands), see Main.parse_file
+        self.parsed = {}
+        # (cwd, argv) of recent requests -> the stamps of their input files
+        self.watched = {}
+
+    def translate(self, cwd: str, argv: typing.List[str]) -> dict:
+        """Runs Main.py in this process.
+
+        Args:
+            cwd (str): the working directory of the request.
+            argv (typing.List[str]): the command line options.
+
+        Returns:
+            dict: the response.
+        """
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        directory = os.getcwd()
+        # the hits and misses that the request prints are its own
+        self.cache.hits = self.cache.misses = self.cache.evicted = 0
+        try:
+            os.chdir(cwd)
+            with contextlib.redirect_stdout(stdout), \
+                    contextlib.redirect_stderr(stderr):
+                try:
+                    status = Main.main(argv, self.cache, self.parsed)
+                except SystemExit as error:
+                    # bad options: argparse already printed why
+                    status = error.code if isinstance(error.code, int) else 1
+                except Exception:
+                    traceback.print_exc()
+                    status = 1
+        finally:
+            os.chdir(directory)
+        self.cache.evict()
+        return {"status": status, "stdout": stdout.getvalue(),
+                "stderr": stderr.getvalue()}
+
+    @staticmethod
+    def stamps(cwd: str, argv: typing.List[str]) -> typing.Optional[dict]:
+        """
+        Args:
+            cwd (str): the working directory of a request.
+            argv (typing.List[str]): its command line options.
+
+        Returns:
+            dict: the modification time and size of every input file of the
+            request, by path, or None if they cannot be found.
+        """
+        try:
+            args, _ = Main.build_arg_parser().parse_known_args(argv)
+            files, _ = Main.input_files(os.path.join(cwd, args.path))
+            stamps = {}
+            for path in files:
+                status = os.stat(path)
+                stamps[path] = (status.st_mtime_ns, status.st_size)
+            return stamps
+        except (OSError, SystemExit):
+            return None
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter) -> None:
+        """Answers a single request."""
+        try:
+            request = json.loads(await reader.readline())
+            cwd, argv = request["cwd"], request["argv"]
+            response = self.translate(cwd, argv)
+            stamps = self.stamps(cwd, argv)
+            if stamps is not None:
+                key = (cwd, tuple(argv))
+                self.watched.pop(key, None)
+                self.watched[key] = stamps
+                while len(self.watched) > MAX_WATCHED:
+                    del self.watched[next(iter(self.watched))]
+        except (ValueError, KeyError, TypeError) as error:
+            response = {"status": 2, "stdout": "",
+                        "stderr": f"error: bad request: {error}\n"}
+        writer.write(json.dumps(response).encode() + b"\n")
+        await writer.drain()
+        writer.close()
+
+    async def watch(self) -> None:
+        """Retranslates recent requests whose input files changed."""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for (cwd, argv), stamps in list(self.watched.items()):
+                current = self.stamps(cwd, list(argv))
+                if current is not None and current != stamps:
+                    self.watched[cwd, argv] = current
+                    self.translate(cwd, list(argv))
+
+    async def serve(self) -> None:
+        """Listens until the process is stopped."""
+        if os.path.exists(self.socket_path):
+            # left behind by a daemon that did not exit cleanly
+            os.remove(self.socket_path)
+        server = await asyncio.start_unix_server(self.handle, self.socket_path)
+        watcher = asyncio.ensure_future(self.watch())
+        # stop cleanly on "kill" too, like on ^C
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            os.remove(self.socket_path)
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser(
+        prog="VMtranslator-daemon",
+        description="Keeps translations in memory for Client.py.")
+    arg_parser.add_argument(
+        "--socket", default=DEFAULT_SOCKET,
+        help="where to listen (default: %(default)s)")
+    arg_parser.add_argument(
+        "--cache-size", type=int, default=256 * 1024 * 1024, metavar="BYTES",
+        help="the most translated code to keep (default: %(default)s)")
+    arg_parser.add_argument(
+        "--poll", type=float, default=POLL_INTERVAL, metavar="SECONDS",
+        help="how often to look for changed input files "
+             "(default: %(default)s)")
+    args = arg_parser.parse_args()
+    try:
+        asyncio.run(Daemon(args.socket, args.cache_size, args.poll).serve())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -0,0 +1,248 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import argparse
+import array
+import os
+import sys
+import typing
+from Assembler import assemble
+
+# ALU control bits (zx nx zy ny f no) -> the computed function of D and Y,
+# where Y is either A or M, according to the "a" bit
+ALU = {
+    0b101010: lambda d, y: 0,
+    0b111111: lambda d, y: 1,
+    0b111010: lambda d, y: -1,
+    0b001100: lambda d, y: d,
+    0b110000: lambda d, y: y,
+    0b001101: lambda d, y: ~d,
+    0b110001: lambda d, y: ~y,
+    0b001111: lambda d, y: -d,
+    0b110011: lambda d, y: -y,
+    0b011111: lambda d, y: d + 1,
+    0b110111: lambda d, y: y + 1,
+    0b001110: lambda d, y: d - 1,
+    0b110010: lambda d, y: y - 1,
+    0b000010: lambda d, y: d + y,
+    0b010011: lambda d, y: d - y,
+    0b000111: lambda d, y: y - d,
+    0b000000: lambda d, y: d & y,
+    0b010101: lambda d, y: d | y,
+}
+# The shift extension (instructions that start with 101): shifts left
+# shift the bits in, shifts right are arithmetic
+SHIFTS = {
+    0b100000: lambda d, y: y << 1,
+    0b110000: lambda d, y: d << 1,
+    0b000000: lambda d, y: (y | -(y & 0x8000)) >> 1,
+    0b010000: lambda d, y: (d | -(d & 0x8000)) >> 1,
+}
+# The stack starts right above the address that SP is initialized to
+STACK_BASE = 256
+RAM_SIZE = 1 << 16
+
+
+def decode(word: int) -> tuple:
+    """Decodes a machine word once, before running the program.
+
+    Args:
+        word (int): the machine word.
+
+    Returns:
+        tuple: (True, value) for A-instructions; (False, function, reads M,
+        writes A, writes D, writes M, jump bits) for C-instructions.
+    """
+    if not word & 0x8000:
+        return True, word
+    control = word >> 6 & 0b111111
+    table = ALU if word & 0x6000 == 0x6000 else SHIFTS
+    if control not in table:
+        raise ValueError(f"Invalid instruction: {word:016b}")
+    return (False, table[control], bool(word & 0x1000), bool(word & 0x20),
+            bool(word & 0x10), bool(word & 0x8), word & 0b111)
+
+
+class Emulator:
+    """Runs Hack machine code.
+
+    The ROM is decoded once up front, and the RAM is an array of 16-bit
+    words. A program halts when it reaches the usual "(X) @X 0;JMP" loop.
+    """
+
+    def __init__(self, words: typing.List[int]) -> None:
+        """Loads a program.
+
+        Args:
+            words (typing.List[int]): the machine words of the program.
+        """
+        self.rom = [decode(word) for word in words]
+        # The @X of "(X) @X 0;JMP" halt loops
+        self.halts = {
+            address for address, (instruction, following)
+            in enumerate(zip(self.rom, self.rom[1:]))
+            if instruction == (True, address) and not following[0] and
+            following[6] == 0b111}
+        self.ram = array.array("H", bytes(2 * RAM_SIZE))
+        self.pc = 0
+        self.a = 0
+        self.d = 0
+        self.cycles = 0
+        self.halted = False
+        self.peak_sp = 0
+
+    @classmethod
+    def from_asm(cls, text: str) -> "Emulator":
+        """Assembles and loads a program.
+
+        Args:
+            text (str): the assembly code.
+
+        Returns:
+            Emulator: the emulator.
+        """
+        return cls(assemble(text)[0])
+
+    @classmethod
+    def from_hack(cls, text: str) -> "Emulator":
+        """Loads a program in the text format of .hack files.
+
+        Args:
+            text (str): one binary machine word per line.
+
+        Returns:
+            Emulator: the emulator.
+        """
+        return cls([int(line, 2) for line in text.split()])
+
+    @classmethod
+    def from_binary(cls, data: bytes) -> "Emulator":
+        """Loads a program of packed words, as written by
+        "VMtranslator --emit hack --hack-format binary".
+
+        Args:
+            data (bytes): 2 bytes per word, big-endian.
+
+        Returns:
+            Emulator: the emulator.
+        """
+        words = array.array("H", data)
+        if sys.byteorder == "little":
+            words.byteswap()
+        return cls(list(words))
+
+    def run(self, max_cycles: int,
+            on_jump: typing.Optional[typing.Callable[[int, int, int], None]]
+            = None) -> int:
+        """Runs the program until it halts, runs past the end of the ROM, or
+        the given number of cycles runs out.
+
+        Args:
+            max_cycles (int): the most instructions to execute.
+            on_jump (typing.Callable[[int, int, int], None]): called after
+                every jump that is taken, with the address of the jump, its
+                target and the instructions executed so far in this run.
+                The instructions in between jumps run one after another, so
+                this is enough to follow the whole run (see Profiler.py).
+
+        Returns:
+            int: the number of instructions executed.
+        """
+        rom = self.rom
+        ram = self.ram
+        halts = self.halts
+        size = len(rom)
+        pc, a, d = self.pc, self.a, self.d
+        peak_sp = self.peak_sp
+        cycles = 0
+        while cycles < max_cycles and pc < size:
+            instruction = rom[pc]
+            if instruction[0]:
+                if pc in halts:
+                    self.halted = True
+                    break
+                a = instruction[1]
+                pc += 1
+                cycles += 1
+                continue
+            _, function, reads_m, writes_a, writes_d, writes_m, jump = \
+                instruction
+            out = function(d, ram[a] if reads_m else a) & 0xFFFF
+            cycles += 1
+            address = a
+            if writes_m:
+                ram[a] = out
+                if a == 0 and out > peak_sp:
+                    peak_sp = out
+            if writes_a:
+                a = out
+            if writes_d:
+                d = out
+            if jump and (jump == 0b111 or
+                         (jump & 0b100 and out & 0x8000) or
+                         (jump & 0b010 and out == 0) or
+                         (jump & 0b001 and 0 < out < 0x8000)):
+                if on_jump is not None:
+                    on_jump(pc, address, cycles)
+                pc = address
+            else:
+                pc += 1
+        self.pc, self.a, self.d = pc, a, d
+        self.peak_sp = peak_sp
+        self.cycles += cycles
+        return cycles
+
+    def report(self) -> dict:
+        """
+        Returns:
+            dict: the cycles executed so far, whether the program halted, the
+            peak stack depth (above address 256) and the registers.
+        """
+        return {"cycles": self.cycles, "halted": self.halted,
+                "peak_stack_depth": max(self.peak_sp - STACK_BASE, 0),
+                "pc": self.pc, "A": self.a, "D": self.d,
+                "SP": self.ram[0], "LCL": self.ram[1], "ARG": self.ram[2],
+                "THIS": self.ram[3], "THAT": self.ram[4]}
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser(
+        prog="Emulator", description="Runs a Hack program.")
+    arg_parser.add_argument("path", help="an .asm, .hack or (packed) .bin file")
+    arg_parser.add_argument(
+        "--cycles", type=int, default=10_000_000,
+        help="stop after this many instructions (default: %(default)s)")
+    arg_parser.add_argument(
+        "--set", action="append", default=[], metavar="ADDRESS=VALUE",
+        help="initialize a RAM word before running, e.g. --set 0=256")
+    arg_parser.add_argument(
+        "--ram", action="append", default=[], metavar="START:END",
+        help="print the final contents of a RAM range, e.g. --ram 256:260")
+    args = arg_parser.parse_args()
+
+    extension = os.path.splitext(args.path)[1].lower()
+    with open(args.path, "rb" if extension == ".bin" else "r") as program_file:
+        program = program_file.read()
+    if extension == ".bin":
+        emulator = Emulator.from_binary(program)
+    elif extension == ".hack":
+        emulator = Emulator.from_hack(program)
+    else:
+        emulator = Emulator.from_asm(program)
+    for assignment in args.set:
+        address, value = assignment.split("=")
+        emulator.ram[int(address)] = int(value) & 0xFFFF
+    emulator.run(args.cycles)
+
+    for name, value in emulator.report().items():
+        print(f"{name}: {value}")
+    for ram_range in args.ram:
+        start, end = (int(bound) for bound in ram_range.split(":"))
+        for address in range(start, end):
+            print(f"RAM[{address}] = {emulator.ram[address]}")
+    if not emulator.halted:
+        print("the program did not halt", file=sys.stderr)
@@ -0,0 +1,167 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import collections
+import IR
+from Parser import Command
+from Folder import constant
+
+JUMPS = {"C_GOTO", "C_IF"}
+
+
+def size(function: IR.Function) -> int:
+    """
+    Returns:
+        int: the number of commands of the function, with its labels.
+    """
+    return sum(len(block.commands) + (block.label is not None)
+               for block in function.blocks)
+
+
+class FlowCleaner:
+    """Cleans up the jumps and labels of every function.
+
+    - if-goto right after "push constant" always or never jumps: it becomes
+      a goto, or is removed with the push.
+    - A jump to a label that is only followed by "goto L2" (and maybe more
+      labels) jumps straight to L2 instead ("jump threading").
+    - Commands that cannot be reached from the start of the function, e.g.
+      after a goto or a return, are removed.
+    - A goto to the label right after it is removed.
+    - Labels that nothing jumps to are removed. Besides the ROM, this helps
+      --stack-cache, which must write the stack out at every label.
+
+    Labels are scoped to their function (see CodeWriter.write_label), so
+    every function is cleaned on its own, as basic blocks (see IR.Function).
+    Opaque functions, which jump to labels they do not have or have commands
+    the graph does not know, are left alone.
+    """
+
+    def __init__(self) -> None:
+        # what was done -> how many times
+        self.cleaned = collections.Counter()
+
+    def clean(self, function: IR.Function) -> IR.Function:
+        """Cleans a single function, in place.
+
+        Args:
+            function (IR.Function): the function.
+
+        Returns:
+            IR.Function: the same function, with its graph and stack depths
+            found again.
+        """
+        if function.opaque:
+            return function
+        self.resolve_branches(function)
+        self.thread_jumps(function)
+        while True:
+            before = size(function)
+            self.remove_unreachable(function)
+            self.remove_jumps_to_next(function)
+            self.remove_labels(function)
+            if size(function) == before:
+                break
+        function.update()
+        return function
+
+    def resolve_branches(self, function: IR.Function) -> None:
+        blocks = function.blocks
+        index = 0
+        while index < len(blocks):
+            commands = blocks[index].commands
+            if len(commands) < 2 or commands[-1].type != "C_IF" or \
+                    constant(commands[-2]) is None:
+                index += 1
+                continue
+            branch = commands.pop()
+            value = constant(commands.pop())
+            self.cleaned["constant branches resolved"] += 1
+            if value:
+                commands.append(Command("C_GOTO", branch.arg1,
+                                        line=branch.line))
+            elif index + 1 < len(blocks) and blocks[index + 1].label is None:
+                # the block now runs on into the next one, whose end may be
+                # resolved as well
+                commands += blocks.pop(index + 1).commands
+                continue
+            index += 1
+
+    def thread_jumps(self, function: IR.Function) -> None:
+        blocks = function.blocks
+        position = {block.label: index for index, block in enumerate(blocks)
+                    if block.label is not None}
+
+        def destination(label: str) -> str:
+            # follows "label L / goto L2" until it ends, or goes in circles
+            seen = {label}
+            while True:
+                index = position[label]
+                while not blocks[index].commands and index + 1 < len(blocks):
+                    index += 1
+                commands = blocks[index].commands
+                if not commands or commands[0].type != "C_GOTO" or \
+                        commands[0].arg1 in seen:
+                    return label
+                label = commands[0].arg1
+                seen.add(label)
+
+        for block in blocks:
+            jump = block.commands[-1] if block.commands else None
+            if jump is None or jump.type not in JUMPS:
+                continue
+            target = destination(jump.arg1)
+            if target != jump.arg1:
+                block.commands[-1] = Command(jump.type, target,
+                                             line=jump.line)
+                self.cleaned["jumps threaded"] += 1
+
+    def remove_unreachable(self, function: IR.Function) -> None:
+        function.link()
+        reachable = function.reachable()
+        if not all(reachable):
+            self.cleaned["unreachable commands removed"] += sum(
+                len(block.commands) + (block.label is not None)
+                for block, keep in zip(function.blocks, reachable)
+                if not keep)
+            function.blocks = [block for block, keep
+                               in zip(function.blocks, reachable) if keep]
+
+    def remove_jumps_to_next(self, function: IR.Function) -> None:
+        blocks = function.blocks
+        for index, block in enumerate(blocks):
+            if not block.commands or block.commands[-1].type != "C_GOTO":
+                continue
+            # the labels right after the goto
+            following = index + 1
+            while following < len(blocks) and \
+                    blocks[following].label is not None:
+                if blocks[following].label == block.commands[-1].arg1:
+                    block.commands.pop()
+                    self.cleaned["jumps to the next command removed"] += 1
+                    break
+                if blocks[following].commands:
+                    break
+                following += 1
+
+    def remove_labels(self, function: IR.Function) -> None:
+        targets = {block.commands[-1].arg1 for block in function.blocks
+                   if block.commands and block.commands[-1].type in JUMPS}
+        blocks = []
+        for block in function.blocks:
+            if block.label is not None and block.label not in targets:
+                block.label = None
+                self.cleaned["unused labels removed"] += 1
+            # a block that nothing jumps to any more is part of the one
+            # before it, if that one runs on into it
+            if block.label is None and blocks and \
+                    not (blocks[-1].commands and
+                         blocks[-1].commands[-1].type in IR.TERMINATORS):
+                blocks[-1].commands += block.commands
+                continue
+            blocks.append(block)
+        function.blocks = blocks
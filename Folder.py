@@ -0,0 +1,133 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import collections
+import typing
+from Parser import Command
+
+MASK = 0xFFFF
+TRUE = MASK  # -1
+
+
+def signed(value: int) -> int:
+    """
+    Args:
+        value (int): a 16-bit word.
+
+    Returns:
+        int: the word as a two's complement number.
+    """
+    return value - 0x10000 if value & 0x8000 else value
+
+
+# command -> the 16-bit result of applying it to constant operands
+BINARY = {
+    "add": lambda x, y: (x + y) & MASK,
+    "sub": lambda x, y: (x - y) & MASK,
+    "and": lambda x, y: x & y,
+    "or": lambda x, y: x | y,
+    "eq": lambda x, y: TRUE if x == y else 0,
+    "gt": lambda x, y: TRUE if signed(x) > signed(y) else 0,
+    "lt": lambda x, y: TRUE if signed(x) < signed(y) else 0,
+}
+UNARY = {
+    "neg": lambda x: -x & MASK,
+    "not": lambda x: ~x & MASK,
+    "shiftleft": lambda x: (x << 1) & MASK,
+    "shiftright": lambda x: (signed(x) >> 1) & MASK,
+}
+# command -> the constant second operand that leaves the first one unchanged
+IDENTITIES = {"add": 0, "sub": 0, "or": 0, "and": TRUE}
+# unary commands that cancel themselves when applied twice
+INVOLUTIONS = {"neg", "not"}
+
+
+def constant(command: Command) -> typing.Optional[int]:
+    """
+    Args:
+        command (Command): a VM command.
+
+    Returns:
+        int: the value that the command pushes, if it pushes a constant.
+    """
+    if command.type == "C_PUSH" and command.arg1 == "constant":
+        return command.arg2 & MASK
+    return None
+
+
+class ConstantFolder:
+    """Simplifies the arithmetic of VM commands before they are translated.
+
+    Arithmetic commands whose operands are all pushed as constants right
+    before them are replaced by a push of the result, computed with the
+    16-bit two's complement semantics of the Hack CPU; operations with an
+    identity operand ("push constant 0 / add") and pairs of "neg" or "not"
+    are removed. Results above 32767 are pushed as "constant" too: the code
+    writer loads them through their complement.
+
+    Only adjacent commands are looked at, so a label between the operands
+    and the operation (a jump target) stops the folding.
+    """
+
+    def __init__(self) -> None:
+        # rule -> the number of commands it removed
+        self.folded = collections.Counter()
+        # value -> the shared "push constant value" command
+        self.constants = {}
+
+    def push_constant(self, value: int,
+                      line: typing.Optional[int] = None) -> Command:
+        if line is not None:
+            return Command("C_PUSH", "constant", value, line)
+        command = self.constants.get(value)
+        if command is None:
+            command = self.constants[value] = Command(
+                "C_PUSH", "constant", value)
+        return command
+
+    def fold(self, commands: typing.Iterable[Command]) -> typing.List[Command]:
+        """Simplifies the commands of a single file.
+
+        Args:
+            commands (typing.Iterable[Command]): the commands.
+
+        Returns:
+            typing.List[Command]: the simplified commands.
+        """
+        result = []
+        for command in commands:
+            if command.type != "C_ARITHMETIC":
+                result.append(command)
+                continue
+            operation = command.arg1
+            top = constant(result[-1]) if result else None
+            if operation in UNARY:
+                if top is not None:
+                    result[-1] = self.push_constant(UNARY[operation](top),
+                                                    result[-1].line)
+                    self.folded["constant"] += 1
+                    continue
+                if operation in INVOLUTIONS and result and \
+                        result[-1].type == "C_ARITHMETIC" and \
+                        result[-1].arg1 == operation:
+                    result.pop()
+                    self.folded["involution"] += 2
+                    continue
+            elif operation in BINARY and top is not None:
+                below = constant(result[-2]) if len(result) > 1 else None
+                if below is not None:
+                    result.pop()
+                    result[-1] = self.push_constant(
+                        BINARY[operation](below, top), result[-1].line)
+                    self.folded["constant"] += 2
+                    continue
+                if IDENTITIES.get(operation) == top:
+                    result.pop()
+                    self.folded["identity"] += 2
+                    continue
+            result.append(command)
+        return result
@@ -0,0 +1,138 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import collections
+import typing
+from Parser import Command
+
+# Segments with an address to read and write, unlike "constant"
+MEMORY = {"local", "argument", "this", "that", "temp", "pointer", "static"}
+
+
+class FusedCommand(Command):
+    """A sequence of commands that is translated as a single superinstruction
+    ("C_FUSED"). arg1 is the name of the pattern, and commands the original
+    commands.
+    """
+    __slots__ = ("commands",)
+
+    def __init__(self, name: str, commands: typing.List[Command]) -> None:
+        super().__init__("C_FUSED", name, line=commands[0].line)
+        self.commands = commands
+
+    def __repr__(self) -> str:
+        return f"FusedCommand({self.arg1!r}, {self.commands!r})"
+
+
+# The matchers look at the first commands of a window of commands, which
+# is long enough for them. Every pattern starts with a push.
+def is_increment(commands: typing.Sequence[Command]) -> bool:
+    """push S i / push constant c / add or sub / pop S i: "S[i] += c"."""
+    load, step, operation, store = commands[0], commands[1], commands[2], \
+        commands[3]
+    return load.type == "C_PUSH" and load.arg1 in MEMORY and \
+        step.type == "C_PUSH" and step.arg1 == "constant" and \
+        step.arg2 <= 0x7FFF and \
+        operation.type == "C_ARITHMETIC" and operation.arg1 in ("add", "sub") \
+        and store.type == "C_POP" and store.arg1 == load.arg1 and \
+        store.arg2 == load.arg2
+
+
+def is_copy(commands: typing.Sequence[Command]) -> bool:
+    """push S i / pop T j: "T[j] = S[i]", e.g. "push argument 0 / pop
+    pointer 0" at the start of every method.
+    """
+    load, store = commands[0], commands[1]
+    return load.type == "C_PUSH" and store.type == "C_POP" and \
+        store.arg1 in MEMORY
+
+
+# name, number of commands, matcher; longest first
+PATTERNS = [
+    ("increment", 4, is_increment),
+    ("copy", 2, is_copy),
+]
+LONGEST = max(length for _, length, _ in PATTERNS)
+
+
+def match(window: typing.Deque[Command]) -> Command:
+    """Takes the next command off a window of commands that starts with a
+    push.
+
+    Args:
+        window (typing.Deque[Command]): the window.
+
+    Returns:
+        Command: a FusedCommand if a pattern starts the window, the first
+        command of the window otherwise.
+    """
+    for name, length, matches in PATTERNS:
+        if len(window) >= length and matches(window):
+            return FusedCommand(name, [window.popleft() for _ in range(length)])
+    return window.popleft()
+
+
+def fuse(commands: typing.Iterable[Command]) -> typing.Iterator[Command]:
+    """Replaces the command sequences of PATTERNS with superinstructions.
+
+    Only a window of a few commands is held at a time, so the input may be a
+    stream. Patterns are matched from the left, the longest one first.
+
+    Args:
+        commands (typing.Iterable[Command]): the commands of a file.
+
+    Returns:
+        typing.Iterator[Command]: the commands, with FusedCommand instead of
+        the sequences that matched.
+    """
+    # the window always starts with a push, or is empty
+    window = collections.deque()
+    for command in commands:
+        if window:
+            window.append(command)
+            if len(window) < LONGEST:
+                continue
+            yield match(window)
+            while window and window[0].type != "C_PUSH":
+                yield window.popleft()
+        elif command.type == "C_PUSH":
+            window.append(command)
+        else:
+            yield command
+    while window:
+        if window[0].type == "C_PUSH":
+            yield match(window)
+        else:
+            yield window.popleft()
+
+
+def tail_calls(commands: typing.Iterable[Command]) -> typing.Iterator[Command]:
+    """Replaces every call that is immediately followed by a return with a
+    single "C_TAIL_CALL" command (arg1 the callee, arg2 the number of
+    arguments, like in "C_CALL").
+
+    Args:
+        commands (typing.Iterable[Command]): the commands of a file.
+
+    Returns:
+        typing.Iterator[Command]: the commands, with the tail calls.
+    """
+    call = None
+    for command in commands:
+        if call is not None:
+            if command.type == "C_RETURN":
+                yield Command("C_TAIL_CALL", call.arg1, call.arg2, call.line)
+                call = None
+                continue
+            yield call
+            call = None
+        if command.type == "C_CALL":
+            call = command
+        else:
+            yield command
+    if call is not None:
+        yield call
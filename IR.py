@@ -0,0 +1,260 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import Command
+from Inliner import Program
+
+# Command types that end a basic block
+TERMINATORS = {"C_GOTO", "C_IF", "C_RETURN"}
+# Command types that the control flow graph knows
+KNOWN = {"C_ARITHMETIC", "C_PUSH", "C_POP", "C_LABEL", "C_CALL"} | TERMINATORS
+# Arithmetic commands that pop two values and push one
+BINARY = {"add", "sub", "and", "or", "eq", "gt", "lt"}
+
+
+def stack_effect(command: Command) -> int:
+    """
+    Args:
+        command (Command): a VM command that the graph knows, but not return.
+
+    Returns:
+        int: how many values the command adds to the stack (negative if it
+        takes them off).
+    """
+    if command.type == "C_PUSH":
+        return 1
+    if command.type in ("C_POP", "C_IF"):
+        return -1
+    if command.type == "C_ARITHMETIC":
+        return -1 if command.arg1 in BINARY else 0
+    if command.type == "C_CALL":
+        # the arguments are replaced with the return value
+        return 1 - command.arg2
+    return 0
+
+
+class BasicBlock:
+    """Commands that run one after another: only the first one is jumped to,
+    and only the last one jumps.
+
+    label is the label the block starts with (None for the start of the
+    function and for the command after a jump), line the line of the label
+    (see Command), and commands are the rest of its commands. successors are
+    the indices of the blocks that may run next, and depth is the number of
+    values on the stack (above the locals) when the block starts, the first
+    way it is reached (None if it cannot be reached).
+    """
+    __slots__ = ("label", "line", "commands", "successors", "depth")
+
+    def __init__(self, label: typing.Optional[str],
+                 line: typing.Optional[int] = None) -> None:
+        self.label = label
+        self.line = line
+        self.commands = []
+        self.successors = []
+        self.depth = None
+
+    def __repr__(self) -> str:
+        return f"BasicBlock({self.label!r}, {len(self.commands)} commands, " \
+               f"successors={self.successors!r}, depth={self.depth!r})"
+
+
+class Function:
+    """A function as basic blocks and the control flow graph between them.
+
+    A function with commands the graph does not know (such as those that
+    inlining adds) or with jumps to labels it does not have is opaque: it
+    is a single block with no successors, and passes should leave it alone.
+    balanced is True if the stack depth at the start of every reachable
+    block does not depend on the way there, and max_depth is the deepest
+    the stack gets (None when unbalanced).
+    """
+
+    def __init__(self, header: Command, body: typing.List[Command]) -> None:
+        """Splits a function into blocks.
+
+        Args:
+            header (Command): the "function" command.
+            body (typing.List[Command]): the commands after it.
+        """
+        self.header = header
+        self.name = header.arg1
+        self.blocks = []
+        self.opaque = False
+        self.balanced = False
+        self.max_depth = None
+        labels = {command.arg1 for command in body
+                  if command.type == "C_LABEL"}
+        if any(command.type not in KNOWN or
+               (command.type in ("C_GOTO", "C_IF") and
+                command.arg1 not in labels) for command in body):
+            self.opaque = True
+            block = BasicBlock(None)
+            block.commands = list(body)
+            self.blocks.append(block)
+            return
+
+        block = BasicBlock(None)
+        for command in body:
+            if command.type == "C_LABEL":
+                if block.commands or block.label is not None:
+                    self.blocks.append(block)
+                block = BasicBlock(command.arg1, command.line)
+                continue
+            block.commands.append(command)
+            if command.type in TERMINATORS:
+                self.blocks.append(block)
+                block = BasicBlock(None)
+        if block.commands or block.label is not None:
+            self.blocks.append(block)
+        self.link()
+        self.annotate()
+
+    def link(self) -> None:
+        """Finds the successors of every block."""
+        position = {block.label: index for index, block
+                    in enumerate(self.blocks) if block.label is not None}
+        for index, block in enumerate(self.blocks):
+            last = block.commands[-1] if block.commands else None
+            following = [index + 1] if index + 1 < len(self.blocks) else []
+            if last is None or last.type not in TERMINATORS:
+                block.successors = following
+            elif last.type == "C_GOTO":
+                block.successors = [position[last.arg1]]
+            elif last.type == "C_IF":
+                block.successors = [position[last.arg1]] + following
+            else:
+                block.successors = []
+
+    def annotate(self) -> None:
+        """Finds the stack depth at the start of every block, by walking the
+        graph from the start of the function.
+        """
+        if not self.blocks:
+            self.balanced = True
+            self.max_depth = 0
+            return
+        self.blocks[0].depth = 0
+        balanced = True
+        deepest = 0
+        pending = [0]
+        while pending:
+            block = self.blocks[pending.pop()]
+            depth = block.depth
+            for command in block.commands:
+                if command.type == "C_RETURN":
+                    break
+                depth += stack_effect(command)
+                deepest = max(deepest, depth)
+            for successor in block.successors:
+                following = self.blocks[successor]
+                if following.depth is None:
+                    following.depth = depth
+                    pending.append(successor)
+                elif following.depth != depth:
+                    balanced = False
+        self.balanced = balanced
+        self.max_depth = deepest if balanced else None
+
+    def update(self) -> None:
+        """Finds the successors and stack depths again, after the blocks
+        were changed.
+        """
+        for block in self.blocks:
+            block.depth = None
+        self.link()
+        self.annotate()
+
+    def reachable(self) -> typing.List[bool]:
+        """
+        Returns:
+            typing.List[bool]: whether every block can be reached from the
+            start of the function.
+        """
+        seen = [False] * len(self.blocks)
+        pending = [0] if self.blocks else []
+        while pending:
+            index = pending.pop()
+            if not seen[index]:
+                seen[index] = True
+                pending.extend(self.blocks[index].successors)
+        return seen
+
+    def commands(self) -> typing.List[Command]:
+        """
+        Returns:
+            typing.List[Command]: the function as commands again, starting
+            with its "function" command.
+        """
+        result = [self.header]
+        for block in self.blocks:
+            if block.label is not None:
+                result.append(Command("C_LABEL", block.label,
+                                      line=block.line))
+            result += block.commands
+        return result
+
+
+class Module:
+    """The IR of a single file: the commands before its first function, which
+    are left alone, and its functions.
+    """
+
+    def __init__(self, path: str, commands: typing.Iterable[Command]) -> None:
+        """
+        Args:
+            path (str): the path of the file.
+            commands (typing.Iterable[Command]): its commands.
+        """
+        self.path = path
+        self.preamble = []
+        self.functions = []
+        header, body = None, None
+        for command in commands:
+            if command.type == "C_FUNCTION":
+                if header is not None:
+                    self.functions.append(Function(header, body))
+                header, body = command, []
+            elif header is None:
+                self.preamble.append(command)
+            else:
+                body.append(command)
+        if header is not None:
+            self.functions.append(Function(header, body))
+
+    def commands(self) -> typing.List[Command]:
+        """
+        Returns:
+            typing.List[Command]: the file as commands again.
+        """
+        result = list(self.preamble)
+        for function in self.functions:
+            result += function.commands()
+        return result
+
+
+def build(program: Program) -> typing.List[Module]:
+    """
+    Args:
+        program (Program): the commands of every file of the program.
+
+    Returns:
+        typing.List[Module]: the IR of every file.
+    """
+    return [Module(path, commands) for path, commands in program]
+
+
+def flatten(modules: typing.List[Module]) -> Program:
+    """
+    Args:
+        modules (typing.List[Module]): the IR of every file of a program.
+
+    Returns:
+        Program: the commands of every file.
+    """
+    return [(module.path, module.commands()) for module in modules]
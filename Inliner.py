@@ -0,0 +1,199 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import os
+import typing
+from Parser import Command
+
+# program: (file path, commands) for every file of the program
+Program = typing.List[typing.Tuple[str, typing.List[Command]]]
+
+
+class InlineCommand(Command):
+    """The start of an inlined function body ("C_INLINE"). arg1 is the
+    callee and arg2 its number of arguments, like in "C_CALL". pointers is
+    True if the body changes THIS or THAT, which must then be saved, and
+    n_vars is the number of locals of the callee.
+    """
+    __slots__ = ("pointers", "n_vars")
+
+    def __init__(self, function_name: str, n_args: int, pointers: bool,
+                 n_vars: int, line: typing.Optional[int] = None) -> None:
+        super().__init__("C_INLINE", function_name, n_args, line)
+        self.pointers = pointers
+        self.n_vars = n_vars
+
+    def __repr__(self) -> str:
+        return f"InlineCommand({self.arg1!r}, {self.arg2!r}, " \
+               f"{self.pointers!r}, {self.n_vars!r})"
+
+
+class Function:
+    """A function of the program, as a candidate for inlining."""
+
+    def __init__(self, filename: str, name: str, n_vars: int) -> None:
+        self.filename = filename
+        self.name = name
+        self.n_vars = n_vars
+        self.body = []
+
+    def is_leaf(self) -> bool:
+        return all(command.type != "C_CALL" for command in self.body)
+
+    def uses_static(self) -> bool:
+        return any(command.type in ("C_PUSH", "C_POP") and
+                   command.arg1 == "static" for command in self.body)
+
+    def writes_pointers(self) -> bool:
+        return any(command.type == "C_POP" and command.arg1 == "pointer"
+                   for command in self.body)
+
+
+class Inliner:
+    """Substitutes the bodies of small leaf functions for the calls to them.
+
+    An inlined body runs in a light frame instead of a full one: LCL and ARG
+    (and THIS and THAT, if the body changes them) are saved to fixed
+    variables, ARG and LCL are pointed at the arguments already on the stack
+    and at the new locals, and every return restores them and jumps to the
+    end of the body. There is no return address to push or jump to. This is
+    only safe because leaf functions never call anything, so inlined frames
+    never nest. The labels of the body are renamed per call site.
+    """
+
+    def __init__(self, max_size: int, budget: int,
+                 cost: typing.Callable[[str, typing.List[Command]], int]) -> None:
+        """Sets up the inliner.
+
+        Args:
+            max_size (int): the most commands a function body may have to be
+                inlined.
+            budget (int): the most instructions that inlining may add to the
+                program, over all call sites.
+            cost (typing.Callable[[str, typing.List[Command]], int]): counts
+                the instructions that the given commands translate to, in the
+                given file.
+        """
+        self.max_size = max_size
+        self.budget = budget
+        self.cost = cost
+        self.functions = {}
+        # (caller, callee, instructions added, cycles saved per call)
+        self.sites = []
+
+    def run(self, program: Program) -> Program:
+        """Inlines the calls of a whole program.
+
+        Args:
+            program (Program): the program.
+
+        Returns:
+            Program: the program with the calls inlined.
+        """
+        for input_path, commands in program:
+            filename = os.path.splitext(os.path.basename(input_path))[0]
+            function = None
+            for command in commands:
+                if command.type == "C_FUNCTION":
+                    function = Function(filename, command.arg1, command.arg2)
+                    self.functions[function.name] = function
+                elif function is not None:
+                    function.body.append(command)
+
+        candidates = {
+            name: function for name, function in self.functions.items()
+            if function.is_leaf() and len(function.body) <= self.max_size and
+            any(command.type == "C_RETURN" for command in function.body)}
+        return [(input_path, self.inline_file(input_path, commands, candidates))
+                for input_path, commands in program]
+
+    def inline_file(self, input_path: str, commands: typing.List[Command],
+                    candidates: typing.Dict[str, Function]) -> typing.List[Command]:
+        """Inlines the calls of a single file.
+
+        Args:
+            input_path (str): the file.
+            commands (typing.List[Command]): its commands.
+            candidates (typing.Dict[str, Function]): the functions that are
+                small enough to inline.
+
+        Returns:
+            typing.List[Command]: the new commands of the file.
+        """
+        filename = os.path.splitext(os.path.basename(input_path))[0]
+        result = []
+        caller = None
+        for command in commands:
+            if command.type == "C_FUNCTION":
+                caller = command.arg1
+            callee = candidates.get(command.arg1) \
+                if command.type == "C_CALL" else None
+            # static variables belong to the file of the callee
+            if callee is None or \
+                    (callee.uses_static() and callee.filename != filename):
+                result.append(command)
+                continue
+            inlined = self.inline_call(callee, command)
+            added = self.cost(filename, inlined) - self.cost(filename, [command])
+            if added > self.budget:
+                result.append(command)
+                continue
+            self.budget -= added
+            # both set up the locals of the callee
+            saved = self.cost(filename, [
+                command, Command("C_FUNCTION", callee.name, callee.n_vars),
+                Command("C_RETURN")]) - \
+                self.cost(filename, [inlined[0], Command("C_INLINE_RETURN")])
+            self.sites.append((caller, callee.name, added, saved))
+            result.extend(inlined)
+        return result
+
+    def inline_call(self, callee: Function, call: Command) -> typing.List[Command]:
+        """Builds the commands that replace a single call.
+
+        Args:
+            callee (Function): the function to inline.
+            call (Command): the call. If it has a line (see Command), the
+                whole body takes it, since the lines of the body are in the
+                file of the callee.
+
+        Returns:
+            typing.List[Command]: the commands.
+        """
+        line = call.line
+        suffix = f"$inline.{len(self.sites)}"
+        end_label = f"{callee.name}$end{suffix}"
+        code = [InlineCommand(callee.name, call.arg2, callee.writes_pointers(),
+                              callee.n_vars, line)]
+        for index, command in enumerate(callee.body):
+            if command.type in ("C_LABEL", "C_GOTO", "C_IF"):
+                command = Command(command.type, command.arg1 + suffix,
+                                  line=line)
+            elif command.type == "C_RETURN":
+                # the last return just falls through to the end
+                last = index == len(callee.body) - 1
+                command = Command("C_INLINE_RETURN",
+                                  None if last else end_label, line=line)
+            elif line is not None:
+                command = Command(command.type, command.arg1, command.arg2,
+                                  line)
+            code.append(command)
+        code.append(Command("C_INLINE_END", end_label, line=line))
+        return code
+
+    def summary(self) -> typing.List[str]:
+        """
+        Returns:
+            typing.List[str]: a line for every inlined call site, and a line
+            with the totals.
+        """
+        lines = [f"inline: {caller}: {callee} ({added:+d} instructions, "
+                 f"{-saved:+d} cycles per call)"
+                 for caller, callee, added, saved in self.sites]
+        lines.append(f"inline: {len(self.sites)} call sites, "
+                     f"{sum(site[2] for site in self.sites):+d} instructions")
+        return lines
@@ -5,30 +5,58 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import argparse
+import concurrent.futures
+import functools
+import io
+import itertools
+import json
 import os
 import sys
+import time
 import typing
-from Parser import Parser
-from CodeWriter import CodeWriter
+from Parser import Parser, Command
+from CodeWriter import CodeWriter, count_instructions
+from Peephole import Peephole
+from Cache import TranslationCache
+from CallGraph import CallGraph, prune
+from Inliner import Inliner
+from Folder import ConstantFolder
+from Flow import FlowCleaner
+from Fuser import fuse, tail_calls
+from Report import RomReport, ROM_SIZE, kind
+from Assembler import HackStream
+from Passes import PassManager, per_file, per_function, whole_program
+import IR
+import SourceMap
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+# optimization -> the lowest -O level that turns it on. The passes over the
+# whole program (see optimization_passes) run in this order, and the others
+# are options of the code writer.
+LEVELS = {"fold": 1, "clean-flow": 1, "inline": 2, "prune": 2,
+          "peephole": 1, "fuse-branches": 1, "superinstructions": 1,
+          "stack-cache": 2, "tail-calls": 2}
 
 
 def translate_file(
-        input_file: typing.TextIO, output_file: typing.TextIO,
-        bootstrap: bool) -> None:
+        input_file: typing.TextIO, code_writer: CodeWriter,
+        bootstrap: bool, report: typing.Optional[RomReport] = None) -> None:
     """Translates a single file.
 
     Args:
         input_file (typing.TextIO): the file to translate.
-        output_file (typing.TextIO): writes all output to this file.
+        code_writer (CodeWriter): writes the output of all the files of the
+            program.
         bootstrap (bool): if this is True, the current file is the 
             first file we are translating.
+        report (RomReport): counts the instructions of every command, if
+            given.
     """
-    # Initialize CodeWriter only once and store it as an attribute
-    if not hasattr(translate_file, "code_writer"):
-        translate_file.code_writer = CodeWriter(output_file)
-
-    code_writer = translate_file.code_writer
-
     # Update the current filename in CodeWriter (essential for static variables and labels)
     input_filename, _ = os.path.splitext(os.path.basename(input_file.name))
     code_writer.set_file_name(input_filename)
@@ -40,51 +68,419 @@ def translate_file(
 
     # Main parsing loop
 
-    parser = Parser(input_file)
-    while parser.has_more_commands():
-        parser.advance()
-        cmd_type = parser.command_type()
+    # Streaming, so that even huge files take little memory
+    parser = Parser(input_file, streaming=True,
+                    numbered=code_writer.source_map)
+    translate_commands(code_writer, parser.commands(), report)
+
+
+def translate_commands(code_writer: CodeWriter,
+                       commands: typing.Iterable[Command],
+                       report: typing.Optional[RomReport] = None) -> None:
+    """Translates the commands of a single file.
+
+    Args:
+        code_writer (CodeWriter): writes the translation, should already be
+            set to the file of the commands.
+        commands (typing.Iterable[Command]): the commands.
+        report (RomReport): counts the instructions of every command, if
+            given. The code writer is then flushed after every command, to
+            count them.
+    """
+    if code_writer.tail_calls:
+        commands = tail_calls(commands)
+    if code_writer.superinstructions:
+        commands = fuse(commands)
+    mapping = code_writer.source_map
+    for command in commands:
+        cmd_type = command.type
+        if report is not None:
+            code_writer.flush()
+            before = code_writer.instructions
+        if mapping:
+            # the prologue of a function is in the function
+            code_writer.mark_source(
+                command.line,
+                command.arg1 if cmd_type == "C_FUNCTION" else None)
 
     # --- Project 7
 
         # Arithmetic commands
         if cmd_type == "C_ARITHMETIC":
-            code_writer.write_arithmetic(parser.arg1())
+            code_writer.write_arithmetic(command.arg1)
 
         # Memory access commands
         elif cmd_type in ("C_PUSH", "C_POP"):
-            code_writer.write_push_pop(cmd_type, parser.arg1(), parser.arg2())
+            code_writer.write_push_pop(cmd_type, command.arg1, command.arg2)
 
     # --- Project 8: Branching Commands ---
         elif cmd_type == "C_LABEL":
-            code_writer.write_label(parser.arg1())
+            code_writer.write_label(command.arg1)
 
         elif cmd_type == "C_GOTO":
-            code_writer.write_goto(parser.arg1())
+            code_writer.write_goto(command.arg1)
 
         elif cmd_type == "C_IF":
-            code_writer.write_if(parser.arg1())
+            code_writer.write_if(command.arg1)
 
         # --- Project 8: Function Commands (To be implemented later) ---
         elif cmd_type == "C_FUNCTION":
-            code_writer.write_function(parser.arg1(), parser.arg2())
+            code_writer.write_function(command.arg1, command.arg2)
 
         elif cmd_type == "C_RETURN":
             code_writer.write_return()
 
         elif cmd_type == "C_CALL":
-            code_writer.write_call(parser.arg1(), parser.arg2())
+            code_writer.write_call(command.arg1, command.arg2)
 
+        elif cmd_type == "C_TAIL_CALL":
+            code_writer.write_tail_call(command.arg1, command.arg2)
 
-if "__main__" == __name__:
-    # Parses the input path and calls translate_file on each input file.
-    # This opens both the input and the output files!
-    # Both are closed automatically when the code finishes running.
-    # If the output file does not exist, it is created automatically in the
-    # correct path, using the correct filename.
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: VMtranslator <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
+        # --- Inlined calls (see Inliner.py) ---
+        elif cmd_type == "C_INLINE":
+            code_writer.write_inline(command.arg1, command.arg2,
+                                     command.pointers, command.n_vars)
+
+        elif cmd_type == "C_INLINE_RETURN":
+            code_writer.write_inline_return(command.arg1)
+
+        elif cmd_type == "C_INLINE_END":
+            code_writer.write_inline_end(command.arg1)
+
+        # --- Superinstructions (see Fuser.py) ---
+        elif cmd_type == "C_FUSED":
+            code_writer.write_fused(command.arg1, command.commands)
+
+        if report is not None:
+            code_writer.flush()
+            report.add(code_writer.filename, code_writer.cur_function,
+                       kind(command), code_writer.instructions - before)
+
+    # The top of the stack may still be held in D at the end of the file
+    code_writer.spill()
+
+
+def translation_cost(options: dict, filename: str,
+                     commands: typing.List[Command]) -> int:
+    """Counts the instructions that the given commands translate to.
+
+    Args:
+        options (dict): the translation options, see translate_worker.
+        filename (str): the file of the commands.
+        commands (typing.List[Command]): the commands.
+
+    Returns:
+        int: the number of instructions.
+    """
+    buffer = io.StringIO()
+    code_writer = CodeWriter(buffer, shared_frames=options["shared_frames"],
+                             stack_cache=options["stack_cache"],
+                             fuse_branches=options["fuse_branches"],
+                             shared_comparisons=options["shared_comparisons"],
+                             superinstructions=options["superinstructions"],
+                             tail_calls=options["tail_calls"])
+    code_writer.set_file_name(filename)
+    translate_commands(code_writer, commands)
+    code_writer.flush()
+    return count_instructions(buffer.getvalue().splitlines())
+
+
+def translate_worker(
+        input_path: str, options: dict,
+        commands: typing.Optional[typing.List[Command]] = None
+) -> typing.Tuple[str, dict]:
+    """Translates a single file into its own buffer. Runs in a worker process
+    when translating with --jobs.
+
+    Args:
+        input_path (str): the file to translate.
+        options (dict): "shared_frames" to use the shared $CALL/$RETURN
+            routines, "peephole" to pass the output through the peephole
+            optimizer, "stack_cache" to keep the top of the stack in D,
+            "fuse_branches" to jump straight from comparisons,
+            "shared_comparisons" to jump to the shared comparison routines,
+            "superinstructions" to translate common sequences as a whole,
+            "tail_calls" to reuse the frame of the caller in tail calls,
+            "report" to count the instructions of every command,
+            "source_map" to mark the source of the code, see
+            CodeWriter.mark_source.
+        commands (typing.List[Command]): the commands of the file, if they
+            were already parsed (and changed) by a whole program pass.
+
+    Returns:
+        typing.Tuple[str, dict]: the assembly code, and the statistics of the
+        code writer, with the instructions removed by each peephole pattern
+        under "peephole" and the RomReport counts under "report".
+    """
+    buffer = io.StringIO()
+    output_stream = Peephole(buffer) if options["peephole"] else buffer
+    code_writer = CodeWriter(
+        output_stream, shared_frames=options["shared_frames"],
+        stack_cache=options["stack_cache"],
+        fuse_branches=options["fuse_branches"],
+        shared_comparisons=options["shared_comparisons"],
+        superinstructions=options["superinstructions"],
+        tail_calls=options["tail_calls"], source_map=options["source_map"])
+    report = RomReport() if options["report"] else None
+    if commands is None:
+        with open(input_path, 'r') as input_file:
+            translate_file(input_file, code_writer, False, report)
+    else:
+        code_writer.set_file_name(
+            os.path.splitext(os.path.basename(input_path))[0])
+        translate_commands(code_writer, commands, report)
+    code_writer.flush()
+    stats = code_writer.stats()
+    if options["peephole"]:
+        output_stream.flush()
+        stats["peephole"] = dict(output_stream.removed)
+    if report is not None:
+        stats["report"] = report.to_dict()
+    return buffer.getvalue(), stats
+
+
+def rom_used(code_writer: CodeWriter, output_stream: typing.TextIO) -> int:
+    """
+    Args:
+        code_writer (CodeWriter): the code writer of the output.
+        output_stream (typing.TextIO): the output, a Peephole if the
+            instructions it removed should be taken off.
+
+    Returns:
+        int: the instructions in the output so far, as of the last time the
+        code writer was flushed.
+    """
+    used = code_writer.instructions
+    if isinstance(output_stream, Peephole):
+        used -= sum(output_stream.removed.values())
+    return used
+
+
+def check_rom(code_writer: CodeWriter, output_stream: typing.TextIO,
+              budget: int, report: typing.Optional[RomReport]) -> None:
+    """Stops the translation as soon as the output outgrows the ROM.
+
+    Args:
+        code_writer (CodeWriter): the code writer of the output.
+        output_stream (typing.TextIO): the output, a Peephole if the
+            instructions it removed should be taken off.
+        budget (int): the most instructions the output may have.
+        report (RomReport): the counts so far, to point at the largest
+            functions.
+
+    Raises:
+        OverflowError: if the output has more than budget instructions.
+    """
+    code_writer.flush()
+    used = rom_used(code_writer, output_stream)
+    if used <= budget:
+        return
+    message = f"the program needs at least {used} words of ROM, " \
+              f"more than the {budget} available"
+    if report is not None:
+        largest = ", ".join(f"{name} ({instructions})" for name, instructions
+                            in report.functions.most_common(5))
+        message += f"; largest functions: {largest}"
+    else:
+        message += "; run with --report text to see the largest functions"
+    raise OverflowError(message)
+
+
+def peak_rss() -> typing.Optional[int]:
+    """
+    Returns:
+        int: the most memory this process has held so far, in bytes, or
+        None where this is unknown.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """
+    Returns:
+        argparse.ArgumentParser: the parser of the command line options.
+    """
+    arg_parser = argparse.ArgumentParser(
+        prog="VMtranslator", description="Translates VM code to Hack assembly.")
+    arg_parser.add_argument("path", help="a .vm file or a directory of them")
+    arg_parser.add_argument(
+        "--shared-frames", action="store_true",
+        help="jump to shared $CALL/$RETURN routines instead of inlining the "
+             "frame protocol at every call and return")
+    arg_parser.add_argument(
+        "--peephole", action="store_true",
+        help="rewrite redundant instruction sequences in the output")
+    arg_parser.add_argument(
+        "--stack-cache", action="store_true",
+        help="keep the top of the stack in D between commands")
+    arg_parser.add_argument(
+        "--fuse-branches", action="store_true",
+        help="translate comparisons followed by if-goto into a single jump")
+    arg_parser.add_argument(
+        "--comparisons", choices=("speed", "size"), default="speed",
+        help="inline every eq/gt/lt (speed), or jump to shared routines "
+             "(size) (default: %(default)s)")
+    arg_parser.add_argument(
+        "--superinstructions", action="store_true",
+        help="translate common sequences of commands (increments, copies) "
+             "as a whole, from memory to memory")
+    arg_parser.add_argument(
+        "--tail-calls", action="store_true",
+        help="let a call that is immediately followed by return reuse the "
+             "frame of the caller")
+    arg_parser.add_argument(
+        "--report", choices=("text", "json"),
+        help="print the instructions per file, the largest functions and the "
+             "most expensive kinds of commands")
+    arg_parser.add_argument(
+        "--report-top", type=int, default=20, metavar="N",
+        help="how many functions and kinds of commands to list "
+             "(default: %(default)s)")
+    arg_parser.add_argument(
+        "--rom-budget", type=int, default=ROM_SIZE, metavar="WORDS",
+        help="fail as soon as the output needs more instructions than this "
+             "(default: %(default)s)")
+    arg_parser.add_argument(
+        "--emit", choices=("asm", "hack"), default="asm",
+        help="write Hack assembly (.asm), or assemble it into machine code "
+             "(.hack, or .bin when packed) (default: %(default)s)")
+    arg_parser.add_argument(
+        "--hack-format", choices=("text", "binary"), default="text",
+        help="with --emit hack, write one line of 16 bits per word (text), "
+             "or 2 bytes per word, big-endian (binary) (default: %(default)s)")
+    arg_parser.add_argument(
+        "--jobs", type=int, default=1, metavar="N",
+        help="translate the files in N worker processes")
+    arg_parser.add_argument(
+        "--cache", metavar="DIR",
+        help="reuse the translations of unchanged files stored in DIR")
+    arg_parser.add_argument(
+        "--cache-size", type=int, default=64 * 1024 * 1024, metavar="BYTES",
+        help="evict the least recently used entries beyond this size")
+    arg_parser.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="print statistics about the translation")
+    arg_parser.add_argument(
+        "--prune", action="store_true",
+        help="only translate the functions that Sys.init can reach")
+    arg_parser.add_argument(
+        "--fold", action="store_true",
+        help="fold constant expressions and remove identity operations")
+    arg_parser.add_argument(
+        "--clean-flow", action="store_true",
+        help="thread jumps, and remove unreachable code, jumps to the next "
+             "command and unused labels, in every function")
+    arg_parser.add_argument(
+        "--inline", action="store_true",
+        help="substitute small leaf functions for the calls to them")
+    arg_parser.add_argument(
+        "--inline-size", type=int, default=12, metavar="COMMANDS",
+        help="the largest function body to inline (default: %(default)s)")
+    arg_parser.add_argument(
+        "--inline-budget", type=int, default=4096, metavar="INSTRUCTIONS",
+        help="the most instructions inlining may add (default: %(default)s)")
+    arg_parser.add_argument(
+        "-O", dest="level", type=int, choices=(0, 1, 2), default=0,
+        help="optimization level: 0 turns nothing on, 1 the local passes "
+             "and code writer options, 2 also inlining, pruning, the stack "
+             "cache and tail calls (default: %(default)s)")
+    arg_parser.add_argument(
+        "--disable", action="append", default=[], choices=list(LEVELS),
+        metavar="NAME",
+        help="turn off an optimization that -O turns on; may be repeated")
+    arg_parser.add_argument(
+        "--source-map", action="store_true",
+        help="write the VM file, line and function of every instruction to "
+             "OUTPUT.map, for Profiler.py")
+    arg_parser.add_argument(
+        "--time-passes", action="store_true",
+        help="print the time every whole-program pass took and the "
+             "instructions it saved")
+    return arg_parser
+
+
+def optimization_passes(args: argparse.Namespace,
+                        options: dict) -> PassManager:
+    """
+    Args:
+        args (argparse.Namespace): the options, see build_arg_parser.
+        options (dict): the translation options, see translate_worker.
+
+    Returns:
+        PassManager: the passes over the whole program.
+    """
+    manager = PassManager()
+    folder = ConstantFolder()
+    folded = []
+
+    def fold(input_path: str, commands: typing.List[Command]
+             ) -> typing.List[Command]:
+        result = folder.fold(commands)
+        folded.append((input_path, len(commands) - len(result)))
+        return result
+
+    def fold_summary() -> typing.List[str]:
+        return [f"fold: {os.path.basename(input_path)}: removed {removed} "
+                f"commands" for input_path, removed in folded] + \
+            [f"fold: {name}: removed {removed} commands"
+             for name, removed in folder.folded.most_common()]
+
+    # Before inlining, so that the costs of the call sites are accurate
+    manager.register("fold", LEVELS["fold"], per_file(fold), fold_summary)
+
+    # After folding, which leaves constant if-goto conditions behind
+    cleaner = FlowCleaner()
+    manager.register(
+        "clean-flow", LEVELS["clean-flow"],
+        per_function(cleaner.clean),
+        lambda: [f"flow: {name}: {count}"
+                 for name, count in cleaner.cleaned.most_common()])
+
+    inliner = Inliner(args.inline_size, args.inline_budget,
+                      functools.partial(translation_cost, options))
+    manager.register("inline", LEVELS["inline"], whole_program(inliner.run),
+                     inliner.summary)
+
+    call_graph = CallGraph()
+    reachable = []
+
+    def prune_program(program: IR.Program) -> IR.Program:
+        for _, commands in program:
+            call_graph.add(commands)
+        if "Sys.init" not in call_graph.calls:
+            return program
+        reachable.append(call_graph.reachable(["Sys.init"]))
+        return [(input_path, list(prune(commands, reachable[0])))
+                for input_path, commands in program]
+
+    def prune_summary() -> typing.List[str]:
+        if not reachable:
+            return ["prune: there is no Sys.init, keeping all functions"]
+        removed = set(call_graph.calls) - reachable[0]
+        return [f"prune: removed {len(removed)} of {len(call_graph.calls)} "
+                f"functions ({sum(call_graph.sizes[name] for name in removed)}"
+                f" commands)"]
+
+    manager.register("prune", LEVELS["prune"], whole_program(prune_program),
+                     prune_summary)
+    return manager
+
+
+def input_files(path: str) -> typing.Tuple[typing.List[str], str]:
+    """Finds the files to translate.
+
+    Args:
+        path (str): a .vm file or a directory of them.
+
+    Returns:
+        typing.Tuple[typing.List[str], str]: the absolute paths of the .vm
+        files, sorted, and the path of the output without its extension.
+    """
+    argument_path = os.path.abspath(path)
     if os.path.isdir(argument_path):
         files_to_translate = [
             os.path.join(argument_path, filename)
@@ -94,13 +490,357 @@ if "__main__" == __name__:
     else:
         files_to_translate = [argument_path]
         output_path, extension = os.path.splitext(argument_path)
-    output_path += ".asm"
-    bootstrap = True
-    with open(output_path, 'w') as output_file:
-        for input_path in files_to_translate:
-            filename, extension = os.path.splitext(input_path)
-            if extension.lower() != ".vm":
-                continue
-            with open(input_path, 'r') as input_file:
-                translate_file(input_file, output_file, bootstrap)
-            bootstrap = False
+    # Sorted, so the output does not depend on the order of the directory
+    files_to_translate = sorted(
+        input_path for input_path in files_to_translate
+        if os.path.splitext(input_path)[1].lower() == ".vm")
+    return files_to_translate, output_path
+
+
+def parse_file(input_path: str, parsed: typing.Optional[dict] = None,
+               numbered: bool = False) -> typing.List[Command]:
+    """Parses a whole file.
+
+    Args:
+        input_path (str): the file.
+        parsed (dict): if given, the commands of files parsed before, by path,
+            with the modification time and size of the file. They are reused
+            while the file is unchanged.
+        numbered (bool): give every command the number of its line, see
+            Parser.
+
+    Returns:
+        typing.List[Command]: the commands of the file.
+    """
+    if parsed is not None:
+        status = os.stat(input_path)
+        stamp = (status.st_mtime_ns, status.st_size, numbered)
+        entry = parsed.get(input_path)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+    with open(input_path, 'r') as input_file:
+        commands = list(Parser(input_file, streaming=True,
+                               numbered=numbered).commands())
+    if parsed is not None:
+        parsed[input_path] = (stamp, commands)
+    return commands
+
+
+class Translation:
+    """The result of translating a single program."""
+
+    def __init__(self, path: str, output_path: str) -> None:
+        self.path = path
+        self.output_path = output_path
+        # the exit status of VMtranslator, 0 if the output was written
+        self.status = 0
+        # why the translation failed, if it did
+        self.error = None
+        # the output of --report, if requested
+        self.report = None
+        # the statistics that VMtranslator prints, a line each
+        self.messages = []
+        # the words of ROM in the output, and the code writer statistics
+        self.instructions = 0
+        self.stats = {}
+        self.seconds = 0.0
+
+
+def make_options(path: str, options: typing.Optional[dict] = None
+                 ) -> argparse.Namespace:
+    """
+    Args:
+        path (str): a .vm file or a directory of them.
+        options (dict): command line options by their long name, with
+            underscores, e.g. {"stack_cache": True, "comparisons": "size"}.
+            The other options keep their defaults.
+
+    Returns:
+        argparse.Namespace: the options, as if parsed from the command line.
+
+    Raises:
+        ValueError: for an unknown option.
+    """
+    args = build_arg_parser().parse_args(["--", path])
+    for name, value in (options or {}).items():
+        if name == "path" or not hasattr(args, name):
+            raise ValueError(f"unknown option: {name}")
+        setattr(args, name, value)
+    return args
+
+
+def translate(paths: typing.Iterable[str],
+              options: typing.Optional[dict] = None,
+              cache: typing.Optional[typing.Any] = None,
+              parsed: typing.Optional[dict] = None) -> typing.List[Translation]:
+    """Translates programs like VMtranslator does, without printing anything.
+    Every program is translated independently, with a code writer of its
+    own, so this can be called any number of times in a process.
+
+    Args:
+        paths (typing.Iterable[str]): .vm files or directories of them.
+        options (dict): the options of all the programs, see make_options.
+        cache: a translation cache shared by the programs, see main.
+        parsed (dict): parsed commands shared by the programs, see
+            parse_file.
+
+    Returns:
+        typing.List[Translation]: the result of every program, in order.
+    """
+    return [translate_program(make_options(path, options), cache, parsed)
+            for path in paths]
+
+
+def translate_program(args: argparse.Namespace,
+                      cache: typing.Optional[typing.Any] = None,
+                      parsed: typing.Optional[dict] = None) -> Translation:
+    """Translates the input path: a single .vm file, or a directory of them
+    into a single file named after it.
+
+    Args:
+        args (argparse.Namespace): the options, see build_arg_parser.
+        cache: see main.
+        parsed (dict): see parse_file.
+
+    Returns:
+        Translation: the result.
+    """
+    started = time.perf_counter()
+    files_to_translate, output_path = input_files(args.path)
+    binary = args.emit == "hack" and args.hack_format == "binary"
+    output_path += {"asm": ".asm", "hack": ".bin" if binary else ".hack"}[
+        args.emit]
+    result = Translation(args.path, output_path)
+    messages = result.messages
+    # -O turns on what is not disabled, and --disable never turns off an
+    # optimization that was asked for on its own (see PassManager.select)
+    for name, level in LEVELS.items():
+        attribute = name.replace("-", "_")
+        if not hasattr(args, attribute):
+            continue
+        if level <= args.level and name not in args.disable:
+            setattr(args, attribute, True)
+    options = {"shared_frames": args.shared_frames, "peephole": args.peephole,
+               "stack_cache": args.stack_cache,
+               "fuse_branches": args.fuse_branches,
+               "shared_comparisons": args.comparisons == "size",
+               "superinstructions": args.superinstructions,
+               "tail_calls": args.tail_calls,
+               "report": args.report is not None,
+               "source_map": args.source_map}
+
+    # Whole program mode: read every file first, to see across files
+    program = None
+    manager = optimization_passes(args, options)
+    passes = manager.select(
+        args.level, [name for name in manager.names()
+                     if getattr(args, name.replace("-", "_"))], args.disable)
+    if passes:
+        modules = IR.build([
+            (input_path, parse_file(input_path, parsed, args.source_map))
+            for input_path in files_to_translate])
+
+        def cost(modules: typing.List[IR.Module]) -> int:
+            return sum(translation_cost(
+                options, os.path.splitext(os.path.basename(module.path))[0],
+                module.commands()) for module in modules)
+
+        program = IR.flatten(manager.run(
+            modules, passes, cost if args.time_passes else None))
+    generating = time.perf_counter()
+
+    report = RomReport() if args.report else None
+    if cache is None and args.cache:
+        cache = TranslationCache(args.cache, args.cache_size)
+    try:
+        bootstrap = True
+        with open(output_path, 'wb' if binary else 'w') as output_file:
+            target = HackStream(output_file, binary) if args.emit == "hack" \
+                else output_file
+            # the translated code, after it is optimized
+            sink = SourceMap.SourceMapStream(target) if args.source_map \
+                else target
+            output_stream = Peephole(sink) if args.peephole else sink
+            code_writer = CodeWriter(
+                output_stream, shared_frames=args.shared_frames,
+                stack_cache=args.stack_cache,
+                fuse_branches=args.fuse_branches,
+                shared_comparisons=args.comparisons == "size",
+                superinstructions=args.superinstructions,
+                tail_calls=args.tail_calls, source_map=args.source_map)
+            if cache is not None or \
+                    (args.jobs > 1 and len(files_to_translate) > 1):
+                if program is None:
+                    program = [(input_path, None)
+                               for input_path in files_to_translate]
+                fragments = [None] * len(program)
+                if cache is not None:
+                    keys = [cache.key(input_path, options, commands)
+                            for input_path, commands in program]
+                    fragments = [cache.get(key) for key in keys]
+                missing = [entry for entry, fragment
+                           in zip(program, fragments) if fragment is None]
+                if args.jobs > 1 and len(missing) > 1:
+                    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+                        translated = list(pool.map(
+                            translate_worker,
+                            [input_path for input_path, _ in missing],
+                            itertools.repeat(options),
+                            [commands for _, commands in missing]))
+                else:
+                    translated = [translate_worker(input_path, options, commands)
+                                  for input_path, commands in missing]
+                translated = iter(translated)
+                for index, fragment in enumerate(fragments):
+                    if fragment is None:
+                        fragments[index] = next(translated)
+                        if cache is not None:
+                            cache.put(keys[index], *fragments[index])
+                if cache is not None:
+                    cache.evict()
+
+                # The workers used their own code writers, and never bootstrap
+                code_writer.write_init()
+                code_writer.flush()
+                if args.peephole:
+                    output_stream.flush()
+                for text, stats in fragments:
+                    sink.write(text)
+                    code_writer.merge(stats)
+                    if args.peephole:
+                        output_stream.removed.update(stats["peephole"])
+                    if report is not None:
+                        report.merge(stats["report"])
+                    check_rom(code_writer, output_stream, args.rom_budget,
+                              report)
+            elif program is not None:
+                for input_path, commands in program:
+                    code_writer.set_file_name(
+                        os.path.splitext(os.path.basename(input_path))[0])
+                    if bootstrap:
+                        code_writer.write_init()
+                    translate_commands(code_writer, commands, report)
+                    bootstrap = False
+                    check_rom(code_writer, output_stream, args.rom_budget,
+                              report)
+            else:
+                for input_path in files_to_translate:
+                    with open(input_path, 'r') as input_file:
+                        translate_file(input_file, code_writer, bootstrap,
+                                       report)
+                    bootstrap = False
+                    check_rom(code_writer, output_stream, args.rom_budget,
+                              report)
+            code_writer.write_routines()
+            code_writer.flush()
+            if args.peephole:
+                output_stream.flush()
+            check_rom(code_writer, output_stream, args.rom_budget, report)
+            if args.emit == "hack":
+                target.finish()
+    except OverflowError as error:
+        os.remove(output_path)
+        result.status = 1
+        result.error = str(error)
+        result.seconds = time.perf_counter() - started
+        return result
+
+    if args.source_map:
+        with open(output_path + ".map", "w") as map_file:
+            json.dump(SourceMap.encode(
+                sink.entries, sink.entry_points,
+                os.path.basename(output_path)), map_file,
+                separators=(",", ":"))
+        messages.append(f"source map: {len(sink.entries)} runs of "
+                        f"instructions, written to {output_path}.map")
+    if report is not None:
+        # the bootstrap, the shared routines and the spills at the ends of
+        # files do not belong to any command
+        report.add("(translator)", "(bootstrap and routines)", "(translator)",
+                   code_writer.instructions - sum(report.files.values()))
+        total = rom_used(code_writer, output_stream)
+        if args.report == "json":
+            result.report = report.json(total, args.report_top)
+        else:
+            result.report = report.text(total, args.report_top)
+    for entry in passes:
+        if entry.summary is not None:
+            messages.extend(entry.summary())
+    if args.time_passes:
+        messages.extend(manager.timing_report())
+        messages.append(
+            f"time-passes: code generation: "
+            f"{1000 * (time.perf_counter() - generating):.1f} ms, "
+            f"{rom_used(code_writer, output_stream)} instructions")
+    if args.shared_frames:
+        messages.append(f"shared frames: {code_writer.calls} calls, "
+                        f"{code_writer.returns} returns, saved "
+                        f"{code_writer.shared_frames_savings()} instructions")
+    if args.superinstructions:
+        for name, hits in code_writer.fused.most_common():
+            messages.append(f"superinstructions: {name}: {hits} hits")
+    if args.tail_calls:
+        messages.append(f"tail calls: {code_writer.tail_call_sites} emitted, "
+                        f"{code_writer.reused_frames} always reuse the frame "
+                        f"of their caller (the others check at run time)")
+    if args.comparisons == "size" or args.verbose:
+        messages.append(
+            f"comparisons: {sum(code_writer.comparisons.values())} "
+            f"translated, speed: {code_writer.comparison_rom(False)} "
+            f"instructions, size: {code_writer.comparison_rom(True)} "
+            f"instructions (using {args.comparisons})")
+    if args.peephole:
+        for name, removed in output_stream.removed.most_common():
+            messages.append(
+                f"peephole: {name}: removed {removed} instructions")
+        messages.append(
+            f"peephole: removed {sum(output_stream.removed.values())} "
+            f"instructions in total")
+    if cache is not None:
+        messages.append(cache.summary())
+    if args.verbose:
+        stats = code_writer.stats()
+        lookups = stats["template_hits"] + stats["template_misses"]
+        messages.append(
+            f"templates: {stats['template_hits']} hits, "
+            f"{stats['template_misses']} misses "
+            f"({100 * stats['template_hits'] / max(lookups, 1):.1f}% "
+            f"hit rate)")
+        if peak_rss() is not None:
+            messages.append(f"memory: peak RSS {peak_rss() / 2 ** 20:.1f} MiB")
+    result.instructions = rom_used(code_writer, output_stream)
+    result.stats = code_writer.stats()
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def main(argv: typing.Optional[typing.List[str]] = None,
+         cache: typing.Optional[typing.Any] = None,
+         parsed: typing.Optional[dict] = None) -> int:
+    """Parses the command line and translates the input path: a single .vm
+    file, or a directory of them into a single file named after it.
+
+    Args:
+        argv (typing.List[str]): the command line options, sys.argv by
+            default.
+        cache: a translation cache to use instead of the one that --cache
+            opens, e.g. the in-memory cache of the daemon.
+        parsed (dict): reuses the parsed commands of unchanged files, see
+            parse_file.
+
+    Returns:
+        int: the exit status.
+    """
+    result = translate_program(build_arg_parser().parse_args(argv), cache,
+                               parsed)
+    if result.report is not None:
+        print(result.report)
+    for line in result.messages:
+        print(line, file=sys.stderr)
+    if result.error is not None:
+        print(f"error: {result.error}", file=sys.stderr)
+    return result.status
+
+
+if "__main__" == __name__:
+    sys.exit(main())
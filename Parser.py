@@ -5,6 +5,9 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import codecs
+import mmap
+import sys
 import typing
 
 ARITHMETIC = {
@@ -13,6 +16,127 @@ ARITHMETIC = {
 }
 COMMANDTYPE = {"push": "C_PUSH", "pop": "C_POP", "label": "C_LABEL", "goto": "C_GOTO", "if-goto": "C_IF",
                "function": "C_FUNCTION", "call": "C_CALL", "return": "C_RETURN"}
+# Command types that take a second, numeric, argument
+WITH_ARG2 = {"C_PUSH", "C_POP", "C_FUNCTION", "C_CALL"}
+# How much of the input the streaming parser reads at a time
+BLOCK_SIZE = 1 << 20
+# The most distinct lines the streaming parser remembers the commands of
+MEMO_SIZE = 4096
+
+
+class Command:
+    """A single tokenized VM command.
+
+    The command type is one of the "C_XXX" strings, arg1 is the arithmetic
+    command itself or the first argument (None for "C_RETURN"), and arg2 is
+    the numeric second argument (None where there is none). All strings are
+    interned, so they can be compared and hashed cheaply.
+    Records are shared between identical lines, so they must not be modified.
+
+    line is the line of the command in its file (from 1), if the parser was
+    asked for it (see Parser), and None otherwise. Records with a line are
+    not shared. A command that a pass writes in place of others takes the
+    line of the first one.
+    """
+    __slots__ = ("type", "arg1", "arg2", "line")
+
+    def __init__(self, command_type: str, arg1: typing.Optional[str] = None,
+                 arg2: typing.Optional[int] = None,
+                 line: typing.Optional[int] = None) -> None:
+        self.type = command_type
+        self.arg1 = arg1
+        self.arg2 = arg2
+        self.line = line
+
+    def __repr__(self) -> str:
+        if self.line is not None:
+            return f"Command({self.type!r}, {self.arg1!r}, {self.arg2!r}, " \
+                   f"{self.line!r})"
+        return f"Command({self.type!r}, {self.arg1!r}, {self.arg2!r})"
+
+
+def tokenize(line: str, index: int = -1) -> Command:
+    """Splits and classifies a single VM command.
+
+    Args:
+        line (str): a VM command, without comments or surrounding whitespace.
+        index (int): the index of the command, for error messages.
+
+    Returns:
+        Command: the tokenized command.
+    """
+    parts = line.split()
+    if not parts:
+        raise ValueError(f"Empty line encountered at index {index}")
+    first = parts[0]
+    if first in ARITHMETIC:
+        return Command("C_ARITHMETIC", sys.intern(first))
+    elif first in COMMANDTYPE:
+        command_type = COMMANDTYPE[first]
+        if command_type == "C_RETURN":
+            return Command(command_type)
+        if len(parts) < 2:
+            raise ValueError(f"Missing argument at index {index}: {line}")
+        if command_type in WITH_ARG2:
+            if len(parts) < 3:
+                raise ValueError(f"Missing argument at index {index}: {line}")
+            return Command(command_type, sys.intern(parts[1]), int(parts[2]))
+        return Command(command_type, sys.intern(parts[1]))
+    else:
+        raise ValueError(f"Unknown command '{first}' at index {index}: {line}")
+
+
+def read_blocks(input_file: typing.TextIO, block_size: int,
+                use_mmap: bool = False) -> typing.Iterator[str]:
+    """Reads a file a block at a time.
+
+    Args:
+        input_file (typing.TextIO): the file.
+        block_size (int): the size of a block.
+        use_mmap (bool): map the file into memory and decode it from there
+            (as UTF-8), instead of reading it through the file object. Files
+            that cannot be mapped (pipes, empty files) are read as usual.
+
+    Returns:
+        typing.Iterator[str]: the blocks.
+    """
+    if use_mmap:
+        try:
+            mapped = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            mapped = None
+        if mapped is not None:
+            with mapped:
+                # a character may be split between two blocks
+                decoder = codecs.getincrementaldecoder("utf-8")()
+                for start in range(0, len(mapped), block_size):
+                    yield decoder.decode(mapped[start:start + block_size])
+                yield decoder.decode(b"", final=True)
+            return
+    while True:
+        block = input_file.read(block_size)
+        if not block:
+            return
+        yield block
+
+
+def read_lines(blocks: typing.Iterable[str]) -> typing.Iterator[str]:
+    """Splits blocks of text into lines.
+
+    Args:
+        blocks (typing.Iterable[str]): the text.
+
+    Returns:
+        typing.Iterator[str]: the lines, without their line endings.
+    """
+    rest = ""
+    for block in blocks:
+        lines = (rest + block).split("\n")
+        # the last line may go on in the next block
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
 
 
 class Parser:
@@ -53,21 +177,92 @@ class Parser:
       - return
     """
 
-    def __init__(self, input_file: typing.TextIO) -> None:
+    def __init__(self, input_file: typing.TextIO, streaming: bool = False,
+                 block_size: int = BLOCK_SIZE, use_mmap: bool = False,
+                 numbered: bool = False) -> None:
         """Gets ready to parse the input file.
 
         Args:
             input_file (typing.TextIO): input file.
+            streaming (bool): parse the file as it is read, a block at a
+                time, instead of reading all of it first. The memory it
+                takes does not grow with the file, but the file must stay
+                open until the last command was read.
+            block_size (int): the size of the blocks, when streaming.
+            use_mmap (bool): map the file into memory, when streaming, see
+                read_blocks.
+            numbered (bool): give every command the number of its line (see
+                Command), for source maps.
         """
         self.lines = []
         self.current = None
         self.index = -1
+        self.stream = None
+        if streaming:
+            self.stream = self.parse(
+                read_lines(read_blocks(input_file, block_size, use_mmap)),
+                numbered)
+            # the command after the current one, read ahead so that
+            # has_more_commands() can tell whether there is one
+            self.next = next(self.stream, None)
+            return
 
-        for line in input_file:
+        numbers = []
+        for number, line in enumerate(input_file, 1):
             line = line.split("//", 1)[0]
             line = line.strip().lstrip("\ufeff")
             if line:
                 self.lines.append(line)
+                numbers.append(number)
+
+        # Every distinct line is split and classified exactly once, and
+        # repeated lines share the same (read-only) Command record
+        self.parsed = []
+        known = {}
+        for index, line in enumerate(self.lines):
+            if numbered:
+                command = tokenize(line, index)
+                command.line = numbers[index]
+                self.parsed.append(command)
+                continue
+            command = known.get(line)
+            if command is None:
+                command = known[line] = tokenize(line, index)
+            self.parsed.append(command)
+
+    @staticmethod
+    def parse(lines: typing.Iterable[str],
+              numbered: bool = False) -> typing.Iterator[Command]:
+        """Strips and tokenizes lines as they are read.
+
+        Args:
+            lines (typing.Iterable[str]): the lines of the input.
+            numbered (bool): give every command the number of its line.
+
+        Returns:
+            typing.Iterator[Command]: the tokenized commands.
+        """
+        # Like in the eager parser, repeated lines share a Command record,
+        # but only the most recent distinct lines are remembered
+        known = {}
+        index = -1
+        for number, line in enumerate(lines, 1):
+            line = line.split("//", 1)[0]
+            line = line.strip().lstrip("\ufeff")
+            if not line:
+                continue
+            index += 1
+            if numbered:
+                command = tokenize(line, index)
+                command.line = number
+                yield command
+                continue
+            command = known.get(line)
+            if command is None:
+                if len(known) >= MEMO_SIZE:
+                    known.clear()
+                command = known[line] = tokenize(line, index)
+            yield command
 
     def has_more_commands(self) -> bool:
         """Are there more commands in the input?
@@ -75,6 +270,8 @@ class Parser:
         Returns:
             bool: True if there are more commands, False otherwise.
         """
+        if self.stream is not None:
+            return self.next is not None
         return self.index + 1 < len(self.lines)
 
     def advance(self) -> None:
@@ -82,9 +279,35 @@ class Parser:
         command. Should be called only if has_more_commands() is true. Initially
         there is no current command.
         """
-        if self.has_more_commands():
+        if self.stream is not None:
+            if self.next is not None:
+                self.index += 1
+                self.current = self.next
+                self.next = next(self.stream, None)
+        elif self.has_more_commands():
             self.index += 1
-            self.current = self.lines[self.index]
+            self.current = self.parsed[self.index]
+
+    def commands(self) -> typing.Iterator[Command]:
+        """Iterates over the remaining commands, without the overhead of
+        advance() and the accessors.
+
+        Returns:
+            typing.Iterator[Command]: the tokenized commands.
+        """
+        if self.stream is not None:
+            while self.next is not None:
+                self.index += 1
+                self.current = self.next
+                # read ahead only when asked for the command after this one
+                yield self.current
+                self.next = next(self.stream, None)
+            return
+        parsed = self.parsed
+        while self.index + 1 < len(parsed):
+            self.index += 1
+            self.current = parsed[self.index]
+            yield self.current
 
     def command_type(self) -> str:
         """
@@ -97,16 +320,7 @@ class Parser:
         """
         if self.current is None:
             raise ValueError("commandType() called before advance() or on empty input")
-        parts = self.current.split()
-        if not parts:
-            raise ValueError(f"Empty line encountered at index {self.index}")
-        first = parts[0]
-        if first in ARITHMETIC:
-            return "C_ARITHMETIC"
-        elif first in COMMANDTYPE:
-            return COMMANDTYPE[first]
-        else:
-            raise ValueError(f"Unknown command '{first}' at index {self.index}: {self.current}")
+        return self.current.type
 
     def arg1(self) -> str:
         """
@@ -117,15 +331,9 @@ class Parser:
         """
         if self.current is None:
             raise ValueError("arg1() called before advance()")
-        parts = self.current.split()
-        ctype = self.command_type()
-
-        if ctype == "C_RETURN":
+        if self.current.type == "C_RETURN":
             raise ValueError("arg1() should not be called if commandType is C_RETURN")
-        elif ctype == "C_ARITHMETIC":
-            return parts[0]  # add,sub,neg
-        else:
-            return parts[1]  # push , pop
+        return self.current.arg1
 
     def arg2(self) -> int:
         """
@@ -134,10 +342,7 @@ class Parser:
             called only if the current command is "C_PUSH", "C_POP", 
             "C_FUNCTION" or "C_CALL".
         """
-        parts = self.current.split()
-        ctype = self.command_type()
-        if ctype not in ("C_PUSH", "C_POP", "C_FUNCTION", "C_CALL"):
+        ctype = self.current.type
+        if ctype not in WITH_ARG2:
             raise ValueError(f"arg2() is not valid for command type {ctype}")
-        return int(parts[2])  # "local", "argument" ....
-
-
+        return self.current.arg2
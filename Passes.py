@@ -0,0 +1,189 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import time
+import typing
+import IR
+from Parser import Command
+from Inliner import Program
+
+# a pass takes the IR of every file of the program, and returns it optimized
+Run = typing.Callable[[typing.List[IR.Module]], typing.List[IR.Module]]
+
+
+def per_file(transform: typing.Callable[[str, typing.List[Command]],
+                                        typing.List[Command]]) -> Run:
+    """
+    Args:
+        transform (typing.Callable): optimizes the commands of a single file,
+            given its path and commands.
+
+    Returns:
+        Run: a pass that applies it to every file.
+    """
+    def run(modules: typing.List[IR.Module]) -> typing.List[IR.Module]:
+        return [IR.Module(module.path,
+                          transform(module.path, module.commands()))
+                for module in modules]
+    return run
+
+
+def per_function(transform: typing.Callable[[IR.Function], IR.Function]
+                 ) -> Run:
+    """
+    Args:
+        transform (typing.Callable[[IR.Function], IR.Function]): optimizes
+            the basic blocks of a single function (and may change them in
+            place).
+
+    Returns:
+        Run: a pass that applies it to every function, straight on the IR;
+        the commands outside of functions are left alone.
+    """
+    def run(modules: typing.List[IR.Module]) -> typing.List[IR.Module]:
+        for module in modules:
+            module.functions = [transform(function)
+                                for function in module.functions]
+        return modules
+    return run
+
+
+def whole_program(transform: typing.Callable[[Program], Program]) -> Run:
+    """
+    Args:
+        transform (typing.Callable[[Program], Program]): optimizes the
+            commands of a whole program.
+
+    Returns:
+        Run: a pass that applies it.
+    """
+    def run(modules: typing.List[IR.Module]) -> typing.List[IR.Module]:
+        return IR.build(transform(IR.flatten(modules)))
+    return run
+
+
+class Pass:
+    """An optimization pass, that runs from optimization level "level" on.
+    summary returns lines of statistics, after it ran.
+    """
+
+    def __init__(self, name: str, level: int, run: Run,
+                 summary: typing.Optional[typing.Callable[[], typing.List[str]]]
+                 = None) -> None:
+        self.name = name
+        self.level = level
+        self.run = run
+        self.summary = summary
+
+
+class PassManager:
+    """Runs optimization passes over the IR of a whole program, in the order
+    they were registered.
+
+    After every pass, the functions whose stack depth did not depend on the
+    path through them must still be that way (unless the pass made them
+    opaque, see IR.Function), or the pass has a bug.
+    """
+
+    def __init__(self) -> None:
+        self.passes = []
+        # (name, seconds, instructions before, instructions after)
+        self.timings = []
+
+    def register(self, name: str, level: int, run: Run,
+                 summary: typing.Optional[typing.Callable[[], typing.List[str]]]
+                 = None, after: typing.Optional[str] = None) -> None:
+        """Adds a pass.
+
+        Args:
+            name (str): the name of the pass.
+            level (int): the lowest optimization level that runs it.
+            run (Run): the pass itself.
+            summary (typing.Callable[[], typing.List[str]]): statistics.
+            after (str): the pass to run it right after, instead of last.
+        """
+        if any(other.name == name for other in self.passes):
+            raise ValueError(f"pass {name} is already registered")
+        index = len(self.passes)
+        if after is not None:
+            index = self.names().index(after) + 1
+        self.passes.insert(index, Pass(name, level, run, summary))
+
+    def names(self) -> typing.List[str]:
+        """
+        Returns:
+            typing.List[str]: the names of the passes, in order.
+        """
+        return [entry.name for entry in self.passes]
+
+    def select(self, level: int, enabled: typing.Iterable[str] = (),
+               disabled: typing.Iterable[str] = ()) -> typing.List[Pass]:
+        """
+        Args:
+            level (int): the optimization level.
+            enabled (typing.Iterable[str]): passes to run at any level.
+            disabled (typing.Iterable[str]): passes that the level should not
+                turn on; they still run if they are enabled. Names of other
+                optimizations are ignored.
+
+        Returns:
+            typing.List[Pass]: the passes to run, in order.
+        """
+        enabled, disabled = set(enabled), set(disabled)
+        unknown = enabled - set(self.names())
+        if unknown:
+            raise ValueError(f"unknown passes: {', '.join(sorted(unknown))}")
+        return [entry for entry in self.passes
+                if (entry.level <= level and entry.name not in disabled) or
+                entry.name in enabled]
+
+    def run(self, modules: typing.List[IR.Module],
+            passes: typing.Iterable[Pass],
+            cost: typing.Optional[typing.Callable[[typing.List[IR.Module]],
+                                                  int]] = None
+            ) -> typing.List[IR.Module]:
+        """Runs passes, one after another.
+
+        Args:
+            modules (typing.List[IR.Module]): the IR of the program.
+            passes (typing.Iterable[Pass]): the passes, see select.
+            cost (typing.Callable): counts the instructions of the program.
+                If given, the time every pass took and the instructions it
+                saved are recorded in timings.
+
+        Returns:
+            typing.List[IR.Module]: the optimized IR.
+
+        Raises:
+            RuntimeError: if a pass unbalanced the stack of a function.
+        """
+        for entry in passes:
+            balanced = {function.name for module in modules
+                        for function in module.functions if function.balanced}
+            before = cost(modules) if cost is not None else None
+            started = time.perf_counter()
+            modules = entry.run(modules)
+            seconds = time.perf_counter() - started
+            for module in modules:
+                for function in module.functions:
+                    if function.name in balanced and \
+                            not function.opaque and not function.balanced:
+                        raise RuntimeError(f"{entry.name} unbalanced the "
+                                           f"stack of {function.name}")
+            if cost is not None:
+                self.timings.append((entry.name, seconds, before,
+                                     cost(modules)))
+        return modules
+
+    def timing_report(self) -> typing.List[str]:
+        """
+        Returns:
+            typing.List[str]: a line for every pass that ran, see run.
+        """
+        return [f"time-passes: {name}: {1000 * seconds:.1f} ms, {before} -> "
+                f"{after} instructions ({after - before:+d})"
+                for name, seconds, before, after in self.timings]
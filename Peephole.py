@@ -0,0 +1,164 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import collections
+import typing
+
+
+def writes_a(line: str) -> bool:
+    """
+    Args:
+        line (str): an assembly line.
+
+    Returns:
+        bool: True if the line may change the A register or is not a plain
+        instruction (a label or an A-instruction).
+    """
+    if line.startswith(("(", "@")):
+        return True
+    return "A" in line.partition("=")[0] if "=" in line else False
+
+
+def literal(pattern: typing.List[str], replacement: typing.List[str]):
+    """Builds a rewrite rule that matches an exact sequence of lines.
+
+    Args:
+        pattern (typing.List[str]): the lines to look for.
+        replacement (typing.List[str]): the lines to put instead.
+
+    Returns:
+        the rewrite function of the rule.
+    """
+    def rewrite(lines):
+        return replacement if lines == pattern else None
+    return rewrite
+
+
+def redundant_load(lines):
+    # @X / <anything that keeps A> / @X: A already holds X
+    if lines[0] == lines[2] and lines[0].startswith("@") and \
+            not writes_a(lines[1]):
+        return lines[:2]
+    return None
+
+
+def dead_load(lines):
+    # @X / @Y: the first load is overwritten before it is used
+    if lines[0].startswith("@") and lines[1].startswith("@"):
+        return lines[1:]
+    return None
+
+
+def jump_to_next(lines):
+    # @L / 0;JMP / (L): the jump lands on the next instruction anyway
+    if lines[1] == "0;JMP" and lines[2] == f"({lines[0][1:]})" and \
+            lines[0].startswith("@"):
+        return lines[2:]
+    return None
+
+
+# The pattern table: (name, number of lines, rewrite function).
+# A rewrite function gets the last lines of the window and returns the lines
+# to replace them with, or None if it does not apply. Append entries to this
+# list (or pass another list to Peephole) to add patterns.
+PATTERNS = [
+    # a push that increments SP, followed by a pop that decrements it (the
+    # @SP reload between them is already gone by then, see redundant-load)
+    ("inc-dec", 2, literal(["M=M+1", "M=M-1"], [])),
+    # what is left of a push followed by a pop: D already holds the value
+    ("push-pop", 6, literal(["@SP", "A=M", "M=D", "@SP", "A=M", "D=M"],
+                            ["@SP", "A=M", "M=D"])),
+    ("store-reload", 2, literal(["M=D", "D=M"], ["M=D"])),
+    ("dec-deref", 2, literal(["M=M-1", "A=M"], ["AM=M-1"])),
+    ("inc-deref", 2, literal(["M=M+1", "A=M"], ["AM=M+1"])),
+    ("redundant-load", 3, redundant_load),
+    ("dead-load", 2, dead_load),
+    ("jump-to-next", 3, jump_to_next),
+]
+
+
+class Peephole:
+    """An output stream that buffers the assembly code written to it in a
+    sliding window, and rewrites redundant instruction sequences before they
+    reach the real output stream.
+    Comments are kept, and are skipped over when matching patterns. Labels
+    are never removed, so no pattern matches across a jump target.
+    """
+
+    def __init__(self, output_stream: typing.TextIO,
+                 patterns: typing.Optional[list] = None,
+                 window: int = 16) -> None:
+        """Initializes the optimizer.
+
+        Args:
+            output_stream (typing.TextIO): the stream to write the optimized
+                code to.
+            patterns (list): the pattern table, PATTERNS by default.
+            window (int): how many lines to hold before writing them out.
+        """
+        self.file = output_stream
+        self.patterns = PATTERNS if patterns is None else patterns
+        self.size = max(window, max(size for _, size, _ in self.patterns))
+        self.window = []
+        self.removed = collections.Counter()
+
+    def write(self, text: str) -> None:
+        """Adds the given lines to the window, optimizing as they come.
+
+        Args:
+            text (str): newline terminated assembly lines.
+        """
+        for line in text.splitlines():
+            self.window.append(line)
+            if not line.startswith("//"):
+                while self.rewrite():
+                    pass
+            if len(self.window) > self.size:
+                extra = len(self.window) - self.size
+                self.file.write("".join(
+                    line + "\n" for line in self.window[:extra]))
+                del self.window[:extra]
+
+    def rewrite(self) -> bool:
+        """Applies the first pattern that matches the end of the window.
+
+        Returns:
+            bool: True if the window was changed.
+        """
+        # indexes of the last code lines in the window, skipping comments
+        indexes = []
+        for index in range(len(self.window) - 1, -1, -1):
+            if not self.window[index].startswith("//"):
+                indexes.append(index)
+                if len(indexes) == self.size:
+                    break
+        indexes.reverse()
+
+        for name, size, rewrite in self.patterns:
+            if size > len(indexes):
+                continue
+            matched = indexes[-size:]
+            replacement = rewrite([self.window[index] for index in matched])
+            if replacement is None:
+                continue
+            comments = [self.window[index]
+                        for index in range(matched[0], len(self.window))
+                        if self.window[index].startswith("//")]
+            self.window[matched[0]:] = comments + list(replacement)
+            self.removed[name] += size - len(replacement)
+            return True
+        return False
+
+    def flush(self) -> None:
+        """Writes out everything that is still in the window."""
+        self.file.write("".join(line + "\n" for line in self.window))
+        self.window = []
+        self.file.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
@@ -0,0 +1,223 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import argparse
+import collections
+import itertools
+import os
+import sys
+import typing
+from Emulator import Emulator
+from SourceMap import SourceMap
+
+
+class Profiler:
+    """Runs a translated program and counts the cycles of every function and
+    VM line.
+
+    The calls are followed with a call stack of its own: a jump to the entry
+    point of a function is a call, unless LCL did not change, which is a
+    tail call that replaces the function on top of the stack. A jump after
+    which LCL is below that of the function on top returns from it (an
+    inlined body moves LCL up, never down). The jumps are those that
+    Emulator.run reports, so the program runs exactly as it would without
+    the profiler.
+    """
+
+    def __init__(self, emulator: Emulator, source_map: SourceMap) -> None:
+        """
+        Args:
+            emulator (Emulator): the loaded program.
+            source_map (SourceMap): its source map.
+        """
+        self.emulator = emulator
+        self.source_map = source_map
+        # (first address, last address) of a run of instructions between
+        # jumps -> times it was executed
+        self.runs = collections.Counter()
+        # call stack (functions, from the outermost one) -> cycles spent
+        # with it on top
+        self.stacks = collections.Counter()
+        # function -> times it was called
+        self.calls = collections.Counter()
+        root = source_map.lookup(emulator.pc)[2]
+        self.stack = [root]
+        # the LCL of every function on the stack
+        self.frames = [emulator.ram[1]]
+        # where the current run of instructions started
+        self.start = emulator.pc
+        # the cycles of this run of the emulator when the top of the stack
+        # last changed
+        self.since = 0
+
+    def run(self, max_cycles: int) -> int:
+        """Runs the program, with Emulator.run, while profiling it.
+
+        Args:
+            max_cycles (int): the most instructions to execute.
+
+        Returns:
+            int: the number of instructions executed.
+        """
+        self.since = 0
+        cycles = self.emulator.run(max_cycles, self.jumped)
+        if self.emulator.pc > self.start:
+            self.runs[self.start, self.emulator.pc - 1] += 1
+        self.start = self.emulator.pc
+        self.stacks[tuple(self.stack)] += cycles - self.since
+        return cycles
+
+    def jumped(self, source: int, target: int, cycles: int) -> None:
+        """Follows the calls and returns, see Emulator.run."""
+        self.runs[self.start, source] += 1
+        self.start = target
+        stack, frames = self.stack, self.frames
+        local = self.emulator.ram[1]
+        if len(stack) > 1 and local < frames[-1]:
+            self.stacks[tuple(stack)] += cycles - self.since
+            self.since = cycles
+            while len(stack) > 1 and local < frames[-1]:
+                stack.pop()
+                frames.pop()
+        callee = self.source_map.entry_points.get(target)
+        if callee is not None:
+            self.stacks[tuple(stack)] += cycles - self.since
+            self.since = cycles
+            self.calls[callee] += 1
+            if local == frames[-1] and len(stack) > 1:
+                stack[-1] = callee
+            else:
+                stack.append(callee)
+                frames.append(local)
+
+    def hits(self) -> typing.List[int]:
+        """
+        Returns:
+            typing.List[int]: address -> times it was executed.
+        """
+        hits = [0] * (len(self.emulator.rom) + 1)
+        for (first, last), times in self.runs.items():
+            hits[first] += times
+            hits[last + 1] -= times
+        return list(itertools.accumulate(hits[:-1]))
+
+    def functions(self) -> typing.Dict[str, typing.Tuple[int, int, int]]:
+        """
+        Returns:
+            typing.Dict[str, typing.Tuple[int, int, int]]: function -> its
+            calls, and its inclusive (with its callees) and exclusive cycles.
+            The cycles of the shared routines count for the function that
+            jumped to them.
+        """
+        inclusive = collections.Counter()
+        exclusive = collections.Counter()
+        for stack, cycles in self.stacks.items():
+            exclusive[stack[-1]] += cycles
+            # a recursive function is only counted once
+            for function in set(stack):
+                inclusive[function] += cycles
+        return {function: (self.calls[function], inclusive[function],
+                           exclusive[function]) for function in inclusive}
+
+    def lines(self) -> typing.Counter:
+        """
+        Returns:
+            typing.Counter: (file, line, function) -> the cycles of its code.
+            The code of no command has no file and line 0.
+        """
+        lines = collections.Counter()
+        lookup = self.source_map.lookup
+        for address, hits in enumerate(self.hits()):
+            if hits:
+                lines[lookup(address)] += hits
+        return lines
+
+    def folded(self) -> typing.List[str]:
+        """
+        Returns:
+            typing.List[str]: the call stacks in the "folded" format of
+            flame graph tools: the functions from the outermost one,
+            separated by ";", then the cycles spent with it on top.
+        """
+        return [f"{';'.join(stack)} {cycles}"
+                for stack, cycles in sorted(self.stacks.items()) if cycles]
+
+    def text(self, top: int) -> str:
+        """
+        Args:
+            top (int): how many functions and lines to list.
+
+        Returns:
+            str: the functions and lines that took the most cycles.
+        """
+        total = max(sum(self.stacks.values()), 1)
+        rows = [f"{'function':32s} {'calls':>9s} {'inclusive':>11s} "
+                f"{'exclusive':>11s} {'excl %':>7s}"]
+        functions = sorted(self.functions().items(),
+                           key=lambda item: -item[1][2])
+        for function, (calls, inclusive, exclusive) in functions[:top]:
+            rows.append(f"{function:32s} {calls:9d} {inclusive:11d} "
+                        f"{exclusive:11d} {100 * exclusive / total:6.1f}%")
+        rows.append("")
+        rows.append(f"{'line':32s} {'function':32s} {'cycles':>11s} "
+                    f"{'%':>7s}")
+        for (filename, line, function), cycles in \
+                self.lines().most_common(top):
+            where = f"{filename}:{line}" if filename is not None else "-"
+            rows.append(f"{where:32s} {function:32s} {cycles:11d} "
+                        f"{100 * cycles / total:6.1f}%")
+        return "\n".join(rows)
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser(
+        prog="Profiler",
+        description="Runs a program translated with --source-map and prints "
+                    "the cycles of every function and VM line.")
+    arg_parser.add_argument("path", help="an .asm, .hack or (packed) .bin file")
+    arg_parser.add_argument(
+        "--map", metavar="FILE",
+        help="the source map (default: PATH.map)")
+    arg_parser.add_argument(
+        "--cycles", type=int, default=10_000_000,
+        help="stop after this many instructions (default: %(default)s)")
+    arg_parser.add_argument(
+        "--set", action="append", default=[], metavar="ADDRESS=VALUE",
+        help="initialize a RAM word before running, e.g. --set 0=256")
+    arg_parser.add_argument(
+        "--top", type=int, default=20, metavar="N",
+        help="how many functions and lines to list (default: %(default)s)")
+    arg_parser.add_argument(
+        "--folded", metavar="FILE",
+        help="write the call stacks to FILE, in the folded format of flame "
+             "graph tools (e.g. flamegraph.pl FILE > profile.svg)")
+    args = arg_parser.parse_args()
+
+    extension = os.path.splitext(args.path)[1].lower()
+    with open(args.path, "rb" if extension == ".bin" else "r") as program_file:
+        program = program_file.read()
+    if extension == ".bin":
+        emulator = Emulator.from_binary(program)
+    elif extension == ".hack":
+        emulator = Emulator.from_hack(program)
+    else:
+        emulator = Emulator.from_asm(program)
+    for assignment in args.set:
+        address, value = assignment.split("=")
+        emulator.ram[int(address)] = int(value) & 0xFFFF
+    profiler = Profiler(emulator, SourceMap.load(args.map or args.path + ".map"))
+    profiler.run(args.cycles)
+
+    print(profiler.text(args.top))
+    report = emulator.report()
+    print(f"\ncycles: {report['cycles']}, halted: {report['halted']}, "
+          f"peak stack depth: {report['peak_stack_depth']}")
+    if args.folded:
+        with open(args.folded, "w") as folded_file:
+            folded_file.write("\n".join(profiler.folded()) + "\n")
+    if not emulator.halted:
+        print("the program did not halt", file=sys.stderr)
@@ -0,0 +1,126 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import collections
+import json
+import typing
+from Parser import COMMANDTYPE
+
+# The words of the Hack ROM
+ROM_SIZE = 32768
+# command type -> its VM keyword
+KEYWORDS = {command_type: keyword for keyword, command_type in COMMANDTYPE.items()}
+KEYWORDS.update({"C_INLINE": "inline call", "C_INLINE_RETURN": "inline return",
+                 "C_INLINE_END": "inline end", "C_TAIL_CALL": "tail call"})
+
+
+def kind(command) -> str:
+    """
+    Args:
+        command (Command): a VM command.
+
+    Returns:
+        str: what the command is counted as: the arithmetic command, the
+        keyword and segment of push and pop, the pattern of a
+        superinstruction, or the keyword.
+    """
+    if command.type == "C_ARITHMETIC":
+        return command.arg1
+    if command.type in ("C_PUSH", "C_POP"):
+        return f"{KEYWORDS[command.type]} {command.arg1}"
+    if command.type == "C_FUSED":
+        return f"fused {command.arg1}"
+    return KEYWORDS.get(command.type, command.type)
+
+
+class RomReport:
+    """Counts the instructions emitted for every function, file and kind of
+    VM command.
+
+    The counts are taken from the code writer, so they are from before
+    --peephole, and code that the code writer holds back (the top of the
+    stack in D, a comparison waiting for an if-goto) is counted with the
+    command that writes it out.
+    """
+
+    def __init__(self) -> None:
+        self.functions = collections.Counter()
+        self.files = collections.Counter()
+        self.kinds = collections.Counter()
+        # kind -> how many commands of it were translated
+        self.commands = collections.Counter()
+
+    def add(self, filename: str, function: typing.Optional[str],
+            command_kind: str, instructions: int) -> None:
+        """Counts the instructions of a single command.
+
+        Args:
+            filename (str): the file of the command.
+            function (str): the function of the command, None outside of
+                functions.
+            command_kind (str): see kind().
+            instructions (int): the instructions emitted for it.
+        """
+        self.functions[function or f"{filename} (top level)"] += instructions
+        self.files[filename] += instructions
+        self.kinds[command_kind] += instructions
+        self.commands[command_kind] += 1
+
+    def to_dict(self) -> dict:
+        return {"functions": dict(self.functions), "files": dict(self.files),
+                "kinds": dict(self.kinds), "commands": dict(self.commands)}
+
+    def merge(self, data: dict) -> None:
+        """Adds the counts of another report, from to_dict().
+
+        Args:
+            data (dict): the counts.
+        """
+        self.functions.update(data["functions"])
+        self.files.update(data["files"])
+        self.kinds.update(data["kinds"])
+        self.commands.update(data["commands"])
+
+    def json(self, total: int, top: int) -> str:
+        """
+        Args:
+            total (int): the instructions in the output.
+            top (int): how many functions and kinds to list.
+
+        Returns:
+            str: the report as a JSON object.
+        """
+        return json.dumps({
+            "total": total, "rom_size": ROM_SIZE,
+            "files": dict(self.files.most_common()),
+            "functions": dict(self.functions.most_common(top)),
+            "kinds": {name: {"instructions": instructions,
+                             "commands": self.commands[name]}
+                      for name, instructions in self.kinds.most_common(top)},
+        }, indent=2)
+
+    def text(self, total: int, top: int) -> str:
+        """
+        Args:
+            total (int): the instructions in the output.
+            top (int): how many functions and kinds to list.
+
+        Returns:
+            str: the report as a table.
+        """
+        lines = [f"ROM: {total} of {ROM_SIZE} words "
+                 f"({100 * total / ROM_SIZE:.1f}%)", "", "files:"]
+        lines += [f"  {instructions:8d}  {name}"
+                  for name, instructions in self.files.most_common()]
+        lines += ["", f"largest functions (top {top}):"]
+        lines += [f"  {instructions:8d}  {name}"
+                  for name, instructions in self.functions.most_common(top)]
+        lines += ["", f"most expensive commands (top {top}):"]
+        lines += [f"  {instructions:8d}  {name} ({self.commands[name]} "
+                  f"commands, {instructions / self.commands[name]:.1f} each)"
+                  for name, instructions in self.kinds.most_common(top)]
+        return "\n".join(lines)
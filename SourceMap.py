@@ -0,0 +1,159 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import bisect
+import json
+import typing
+
+VERSION = 1
+# what the code of no function is called
+NO_FUNCTION = "(top level)"
+# the comments that CodeWriter.mark_source writes: the start of the code of
+# a command (file, line and function, separated by tabs), and the entry
+# point of a function
+MARK = "//$source"
+ENTRY_MARK = "//$entry"
+
+
+def encode(entries: typing.List[tuple], entry_points: typing.Dict[str, int],
+           output: str) -> dict:
+    """Packs the source map of a SourceMapStream.
+
+    The map is a JSON object: "files" and "functions" are tables of names,
+    and "mappings" is a flat list of 4 numbers for every run of
+    instructions: its first instruction, its file and function (indices
+    into the tables, -1 for none) and its VM line (from 1, 0 if unknown).
+    A run lasts until the first instruction of the next one.
+
+    Args:
+        entries (typing.List[tuple]): SourceMapStream.entries.
+        entry_points (typing.Dict[str, int]): SourceMapStream.entry_points.
+        output (str): the name of the translated program.
+
+    Returns:
+        dict: the source map.
+    """
+    files, functions = {}, {}
+    mappings = []
+    for start, filename, line, function in entries:
+        file_index = -1 if filename is None else \
+            files.setdefault(filename, len(files))
+        function_index = -1 if function is None else \
+            functions.setdefault(function, len(functions))
+        mappings += [start, file_index, line or 0, function_index]
+    return {"version": VERSION, "output": output,
+            "files": [f"{filename}.vm" for filename in files],
+            "functions": list(functions), "mappings": mappings,
+            "entry_points": entry_points}
+
+
+class SourceMapStream:
+    """An output stream that takes the marks of CodeWriter.mark_source out of
+    the code written to it, and records the instruction each one was at.
+
+    It goes last, right before the real output, so that the map is of the
+    code that is written out: a Peephole in front of it keeps the marks (as
+    it keeps all comments) while it removes instructions.
+    """
+
+    def __init__(self, output_stream: typing.TextIO) -> None:
+        """
+        Args:
+            output_stream (typing.TextIO): the stream to write the code to.
+        """
+        self.file = output_stream
+        # the instructions written out so far
+        self.instructions = 0
+        # (first instruction, file, line, function) for every run of
+        # instructions, in order
+        self.entries = []
+        # function -> its first instruction
+        self.entry_points = {}
+
+    def write(self, text: str) -> None:
+        """
+        Args:
+            text (str): newline terminated assembly lines.
+        """
+        lines = []
+        for line in text.splitlines(True):
+            if line.startswith(MARK):
+                _, filename, number, function = line.rstrip("\n").split("\t")
+                entry = (self.instructions, filename or None, int(number),
+                         function or None)
+                # a command without code of its own
+                if self.entries and self.entries[-1][0] == self.instructions:
+                    self.entries[-1] = entry
+                else:
+                    self.entries.append(entry)
+            elif line.startswith(ENTRY_MARK):
+                self.entry_points[line.rstrip("\n").split("\t")[1]] = \
+                    self.instructions
+            else:
+                lines.append(line)
+                if not line.startswith(("(", "//")):
+                    self.instructions += 1
+        self.file.write("".join(lines))
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+class SourceMap:
+    """Finds the source of every instruction of a translated program."""
+
+    def __init__(self, data: dict) -> None:
+        """
+        Args:
+            data (dict): a source map, see encode.
+
+        Raises:
+            ValueError: for a map of another version.
+        """
+        if data.get("version") != VERSION:
+            raise ValueError(f"unknown source map version: "
+                             f"{data.get('version')}")
+        self.files = data["files"]
+        self.functions = data["functions"]
+        mappings = data["mappings"]
+        self.starts = mappings[0::4]
+        self.sources = [
+            (self.files[file_index] if file_index >= 0 else None, line,
+             self.functions[function] if function >= 0 else NO_FUNCTION)
+            for file_index, line, function
+            in zip(mappings[1::4], mappings[2::4], mappings[3::4])]
+        # first instruction -> function
+        self.entry_points = {address: function for function, address
+                             in data["entry_points"].items()}
+
+    @classmethod
+    def load(cls, path: str) -> "SourceMap":
+        """
+        Args:
+            path (str): a source map file, as written by VMtranslator
+                --source-map.
+
+        Returns:
+            SourceMap: the map.
+        """
+        with open(path, "r") as map_file:
+            return cls(json.load(map_file))
+
+    def lookup(self, address: int) -> typing.Tuple[
+            typing.Optional[str], int, str]:
+        """
+        Args:
+            address (int): the address of an instruction.
+
+        Returns:
+            typing.Tuple[typing.Optional[str], int, str]: its VM file (None
+            for code of no command), line (0 if unknown) and function.
+        """
+        index = bisect.bisect_right(self.starts, address) - 1
+        if index < 0:
+            return None, 0, NO_FUNCTION
+        return self.sources[index]